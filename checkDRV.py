@@ -26,7 +26,9 @@ import subprocess
 import re
 import csv
 import math
+import smart
 from datetime import datetime
+from dataclasses import asdict
 from collections import namedtuple
 
 from utils import cPrint, getBaseParser, sendNotification, CONF, checkSudo, SCANID
@@ -41,10 +43,14 @@ args = parser.parse_args()
 # Configurations
 ##############################################################################80
 datapath = CONF["drives"]["storagePath"]
+smartWorkers = CONF["drives"].get("workers", 16)
+smartTimeout = CONF["drives"].get("timeout", 30)  # seconds per drive
 Drive = namedtuple(
     "Drive", "Serial Model Capacity FirstHeard LastHeard Lifetime CurTemp Cycles RALCs"
 )
 Health = namedtuple("Health", "SCANID Attributes")
+# IDs of the ATA attributes kept as health data, described below
+watchedAttributes = (1, 3, 5, 7, 9, 10, 12, *range(187, 200))
 
 
 ##############################################################################80
@@ -76,7 +82,7 @@ def findDrives():
 
 
 ##############################################################################80
-# Queries S.M.A.R.T. data for a given drive.
+# Parses the S.M.A.R.T. report of a drive into alerts and health data.
 # ID   | Attribute Title               | Description
 # -----|-------------------------------|----------------------------------------------------------------
 # 1    | Raw_Read_Error_Rate           | Hardware read errors reported; high values can indicate failing disk surfaces.
@@ -102,102 +108,33 @@ def findDrives():
 
 
 ##############################################################################80
-def querySMART(drive):
-    cPrint(f"Querying SMART for {drive}...", "BLUE") if args.debug else None
-    serial = False
-
-    (
-        cPrint(output, "BLUE") if args.debug else None
-    )  # Print the SMART data if debugging is enabled
-
-    try:
-        # output = subprocess.check_output(["/usr/sbin/smartctl", "-a", drive], text=True)
-        output = subprocess.check_output(
-            ["/usr/sbin/smartctl", "-a", drive], stderr=subprocess.STDOUT, text=True
-        )
-
-        (
-            cPrint(output, "BLUE") if args.debug else None
-        )  # Print the SMART data if debugging is enabled
-
-        # Initialize the return structure
-        drive = {}
-        health = {}
-
-        # Parse output for hardware info and health data
-        for line in output.splitlines():
-
-            if "Serial Number:" in line:
-                drive["serial"] = line.split(":")[1].strip()
-            elif "Device Model:" in line or "Model Number:" in line:
-                drive["model"] = line.split(":")[1].strip()
-            elif "User Capacity:" in line:
-                # capacity_match = re.search(r'\[.*?(\d+,\d+,\d+|\d+.\d+|\d+) bytes\]', line)
-                capacity_match = re.search(r"(\d+,\d+|\d+)", line.replace(",", ""))
-                if capacity_match:
-                    drive["capacity"] = bytesToHuman(
-                        int(capacity_match.group(0).replace(",", ""))
-                    )
-                else:
-                    drive["capacity"] = None
-            elif "Power_On_Hours" in line:
-                lifetime_hours = int(line.split()[-1])
-                drive["lifetime"] = hoursToHuman(lifetime_hours)
-            elif "Temperature_Celsius" in line:
-                temp_match = re.search(
-                    r"(\d+)", line.split()[-1]
-                )  # Use regex to find the first group of digits
-                if temp_match:
-                    drive["maxTemp"] = int(
-                        temp_match.group(0)
-                    )  # Convert the first group of digits to int
-                else:
-                    drive["maxTemp"] = (
-                        None  # Handle cases where no temperature is found
-                    )
-            elif "Power_Cycle_Count" in line:
-                drive["powerCycles"] = int(line.split()[-1])
-            elif "Reallocated_Sector_Ct" in line:
-                drive["reallocations"] = int(line.split()[-1])
-
-            # Parse S.M.A.R.T. attributes
-            attributes = [
-                "1",
-                "3",
-                "5",
-                "7",
-                "9",
-                "10",
-                "12",
-                "187",
-                "188",
-                "189",
-                "190",
-                "191",
-                "192",
-                "193",
-                "194",
-                "195",
-                "196",
-                "197",
-                "198" "199",
-            ]
-            match = re.match(r"^\s*(\d+)\s+(\w+[\w\s]*\w+)\s+.*\s+(\d+)\s+.*$", line)
-            if match:
-                attr_id, attr_name, raw_value = match.groups()
-                try:
-                    value = int(raw_value)
-                    if attr_id in attributes:  # Critical attributes
-                        health[attr_id] = value
-                except ValueError:
-                    continue
-
-        # return drive, health
-        return drive
-
-    except subprocess.CalledProcessError as e:
-        cPrint(f"SMART query failed for {drive}: {e.output}", "RED")
+def parseSMART(drive, report):
+    if report is None:
+        cPrint(f"SMART query failed or timed out for {drive}.", "RED")
         return False
+    cPrint(report, "BLUE") if args.debug else None
+
+    # NVMe and SCSI drives have no attribute table, their health log stands in
+    if report.nvme or report.scsi:
+        health = asdict(report.nvme or report.scsi)
+    else:
+        health = {
+            str(id): report.attributes[id].raw
+            for id in watchedAttributes
+            if id in report.attributes
+        }
+
+    reallocated = report.attributes.get(5)
+    return {
+        "serial": report.serial,
+        "model": report.model,
+        "capacity": bytesToHuman(report.capacity),
+        "lifetime": hoursToHuman(report.powerOnHours),
+        "maxTemp": report.temperature,
+        "powerCycles": report.powerCycles,
+        "reallocations": reallocated.raw if reallocated else 0,
+        "health": health,
+    }
 
 
 ##############################################################################80
@@ -367,11 +304,13 @@ def main():
     aggregated = {}
     DRIVES = ["sda", "sdb", "sdc", "sdd", "sde", "sdf"]
     RAIDS = ["md1"]
-    # Gather HDD health informations
+    # Gather HDD health informations, querying all drives at once
     drives = findDrives()
     cPrint(drives)
-    for drive in drives:
-        health = querySMART(drive)
+    reports = smart.queryDrives(drives, smartWorkers, smartTimeout)
+    for drive, (report, elapsed) in reports.items():
+        cPrint(f"SMART of {drive} in {elapsed:.2f}s", "BLUE") if args.debug else None
+        health = parseSMART(drive, report)
         if health:
             aggregated[drive] = health
 
@@ -24,6 +24,7 @@ import sys
 import subprocess
 import re
 import csv
+import smart
 from datetime import datetime
 from collections import namedtuple
 
@@ -39,20 +40,18 @@ args = parser.parse_args()
 # Configurations
 ##############################################################################80
 datapath = CONF["drives"]["storagePath"]
+smartWorkers = CONF["drives"].get("workers", 16)
+smartTimeout = CONF["drives"].get("timeout", 30)  # seconds per drive
 
 
 ##############################################################################80
-# Queries S.M.A.R.T. data for a given drive.
+# Parses the S.M.A.R.T. report of a drive into alerts and health data.
 ##############################################################################80
-def querySMART(drive):
-    p = subprocess.Popen(
-        ["/usr/sbin/smartctl", "-a", "/dev/" + drive], stdout=subprocess.PIPE
-    )
-    (output, err) = p.communicate()
-    output = output.decode("utf-8")
+def parseSMART(report):
+    if report is None:
+        return 1, {"SMART_Query": "FAILED"}
 
-    if VERBOSE:
-        print(output)
+    cPrint(report, "BLUE") if args.debug else None
 
     health = {}
     alert = 0
@@ -60,51 +59,58 @@ def querySMART(drive):
     # Offline_Uncorrectable
     # Reallocated_Event_Count
     # Current_Pending_Sector
-    crit = ["198", "196", "197"]
-
-    # warn = ["", "", "", "", "", "", ""]
+    crit = [198, 196, 197]
 
     # Wear_Leveling_Count
     # Reallocated_Sector_Ct
     # Temperature_Celsius
     # Media_Wearout_Indicator
-    info = ["173", "5", "194", "233"]
+    info = [173, 5, 194, 233]
 
-    for line in output.splitlines():
-        # Find only the lines with the attributes
-        if line[28:32] != "0x00":
-            continue
-
-        # 0 ID
-        # 1 ATTRIBUTE_NAME
-        # 2 FLAG
-        # 3 VALUE
-        # 4 WORST
-        # 5 THRESH
-        # 6 TYPE
-        # 7 UPDATED
-        # 8 WHEN_FAILED
-        # 9 RAW_VALUE
-        line = re.sub("\s+", " ", str(line).strip())
-        line = line.split(" ")
+    for attribute in report.attributes.values():
+        if attribute.id in crit and attribute.raw > 0:
+            health[attribute.name + "*"] = attribute.raw
+            alert += 1
 
-        value = line[9]
-        # try-except is needed in case Rll_Ev_Ct value is messed up
-        try:
-            value = int(value)
-        except Exception:
-            continue
+        # The raw temperature packs min/max into its high bytes
+        if attribute.id in info:
+            health[attribute.name] = attribute.raw
+            if attribute.id == 194:
+                health[attribute.name] = report.temperature
 
-        if line[0] in crit and value > 0:
-            health[line[1] + "*"] = value
+        if attribute.whenFailed == "now":
+            health[attribute.name] = "FAILING NOW"
             alert += 1
 
-        if line[0] in info:
-            health[line[1]] = value
-
-        if line[8] == "FAILING NOW":
-            health[line[1]] = line[8]
+    # NVMe and SCSI drives report a health log instead of attributes
+    if report.nvme:
+        nvme = report.nvme
+        if nvme.criticalWarning > 0:
+            health["Critical_Warning*"] = nvme.criticalWarning
+            alert += 1
+        if nvme.mediaErrors > 0:
+            health["Media_Errors*"] = nvme.mediaErrors
             alert += 1
+        if nvme.availableSpare < nvme.spareThreshold:
+            health["Available_Spare*"] = nvme.availableSpare
+            alert += 1
+        health["Percentage_Used"] = nvme.percentageUsed
+        health["Temperature"] = report.temperature
+
+    if report.scsi:
+        scsi = report.scsi
+        uncorrected = scsi.readUncorrected + scsi.writeUncorrected
+        if scsi.grownDefects > 0:
+            health["Grown_Defects*"] = scsi.grownDefects
+            alert += 1
+        if uncorrected > 0:
+            health["Uncorrected_Errors*"] = uncorrected
+            alert += 1
+        health["Temperature"] = report.temperature
+
+    if not report.passed:
+        health["SMART_Status"] = "FAILING NOW"
+        alert += 1
 
     return alert, health
 
@@ -288,9 +294,12 @@ def main():
     aggregated = {}
     DRIVES = ["sda", "sdb"]
     RAIDS = ["md1"]
-    # Gather HDD health informations
-    for drive in DRIVES:
-        alert, health = querySMART(drive)
+    # Gather HDD health informations, querying all drives at once
+    devices = ["/dev/" + drive for drive in DRIVES]
+    reports = smart.queryDrives(devices, smartWorkers, smartTimeout)
+    for drive, (report, elapsed) in zip(DRIVES, reports.values()):
+        cPrint(f"SMART of {drive} in {elapsed:.2f}s", "BLUE") if args.debug else None
+        alert, health = parseSMART(report)
         if alert > 0:
             noAlerts = False
             aggregated[drive] = health
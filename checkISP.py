@@ -4,17 +4,36 @@
 # ISP Speed Monitor 20231227
 ##############################################################################80
 # Description: Check ISP speeds and maintains human-readable records, sends
-# notifications via PushOver if speeds are outside of defined bounderies.
+# notifications via PushOver if speeds are outside of defined bounderies, or
+# deviate from the usual speeds at that hour of the week.
 # Usage via CRON: (Runs every hour on minute four)
 #   4 * * * * cd /path/to/folder && ./checkISP.py --cron 2>&1 | ./tailog.py
+# Archive closed days nightly, for history queries without parsing CSVs:
+#   5 0 * * * cd /path/to/folder && ./checkISP.py -c --compact | ./tailog.py
+# Usage with adaptive scheduling: (Runs every five minutes, tests when due)
+#   */5 * * * * cd /path/to/folder && ./checkISP.py --cron -s 2>&1 | ./tailog.py
+# While escalated, the built-in tester runs short tests, kept apart from the
+# records in daily/YYYYMMDD.short.csv; speedtest always runs its full test.
+# Usage as a prober: (Never exits, so a systemd unit runs it rather than cron)
+#   ExecStart=/path/to/folder/checkISP.py --cron --probe
+#   WorkingDirectory=/path/to/folder, probe lines are read with journalctl
 # Usage via CLI:
-#   cd /path/to/folder && ./checkISP.py (-cdnqrt)
-#   Flags:  -c: Formats messages into loggable format, with more information.
+#   cd /path/to/folder && ./checkISP.py (-bcdnqrtv)
+#   Flags:  -b: measures with the built-in tester instead of speedtest.
+#           -c: Formats messages into loggable format, with more information.
 #           -d: activates debug messages during run, to track progress.
 #           -n: use generated scan instead of running speedtest.
+#           --probe: probes latency, jitter and loss of targets every minute.
 #           -q: disables push notifications, prints message to terminal.
-#           -r: recalculates all summaries for current year.
+#           -r: recalculates summaries of YYYY[MMDD][-YYYY[MMDD]], or this year.
+#           -s: tests only when due, adapting the cadence to the results.
 #           -t: overrides passing conditions to test notifications.
+#           -p: prints p5/p50/p95 per day, month and year of a range.
+#           -v: prints the tests and summary of a day, defaults to today.
+#           --bench N: times recalculation of N years of generated tests.
+#           --compact: folds closed days into the columnar archive.
+#           --history RANGE: prints min/avg/max of a range from the archive.
+#           --report: renders the static HTML report, also done after tests.
 ##############################################################################80
 # Copyright (c) Liam Siira (www.siira.io), distributed as-is and without
 # warranty under the MIT License. See [root]/LICENSE.md for more.
@@ -22,21 +41,41 @@
 
 import os, sys
 import time
+import asyncio
 import json
 import csv
+import math
 import statistics
 import subprocess
 import glob
 import re
+import random
+import tempfile
+import mmap
+import bisect
+import socket
+import urllib.parse
+import requests
 
-from datetime import datetime
+from datetime import datetime, timedelta
+from array import array
 from collections import namedtuple
+from functools import reduce
+from operator import add, mul
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from utils import cPrint, getBaseParser, pingHealth, sendNotification, SCANID, CONF
+from utils import appendSynced, lineBuffered
 
 ##############################################################################80
 # Global variables
 ##############################################################################80
 parser = getBaseParser("Runs and stores speedtest of ISP.")
+parser.add_argument(
+    "-b",
+    "--builtin",
+    action="store_true",
+    help="Measures with the built-in tester instead of speedtest.",
+)
 parser.add_argument(
     "-n",
     "--noscan",
@@ -46,26 +85,135 @@ parser.add_argument(
 parser.add_argument(
     "-r",
     "--recalc",
+    nargs="?",
+    const=time.strftime("%Y"),
+    metavar="RANGE",
+    help="Recalculates summaries of YYYY[MMDD][-YYYY[MMDD]], or current year.",
+)
+parser.add_argument(
+    "-p",
+    "--percentiles",
+    nargs="?",
+    const=time.strftime("%Y"),
+    metavar="RANGE",
+    help="Prints p5/p50/p95 of YYYY[MMDD][-YYYY[MMDD]], or current year.",
+)
+parser.add_argument(
+    "-s",
+    "--schedule",
+    action="store_true",
+    help="Tests only when due, adapting the cadence to the results.",
+)
+parser.add_argument(
+    "-v",
+    "--view",
+    nargs="?",
+    const=time.strftime("%Y%m%d"),
+    metavar="YYYYMMDD",
+    help="Prints the tests and summary of a day, defaults to today.",
+)
+parser.add_argument(
+    "--bench",
+    type=int,
+    nargs="?",
+    const=6,
+    metavar="YEARS",
+    help="Times recalculation of years of generated tests, defaults to 6.",
+)
+parser.add_argument(
+    "--probe",
+    action="store_true",
+    help="Probes latency, jitter and loss of targets every minute.",
+)
+parser.add_argument(
+    "--compact",
     action="store_true",
-    help="Recalculates all summaries for current year.",
+    help="Folds closed days into the columnar archive.",
+)
+parser.add_argument(
+    "--history",
+    metavar="RANGE",
+    help="Prints min/avg/max of YYYY[MMDD][-YYYY[MMDD]] from the archive.",
+)
+parser.add_argument(
+    "--report",
+    action="store_true",
+    help="Renders the static HTML report, also done after each test.",
 )
 args = parser.parse_args()
 
 SpeedTest = namedtuple("SpeedTest", ("DateTime Ping Download Upload"))
+testHeader = "{:^14}|{:^6}|{:^8}|{:^8}"
+testFormat = "{:^14}|{:>5} | {:<7}|{:>7}"
+ShortTest = namedtuple("ShortTest", SpeedTest._fields + ("Tester", "Seconds"))
+shortHeader = testHeader + "|{:^9}|{:^7}"
+shortFormat = testFormat + "|{:^9}|{:>7}"
 DailySummary = namedtuple(
     "DailySummary", ("Date AvgPing MinDown AvgDown MaxDown MinUp AvgUp MaxUp")
 )
+summaryHeader = "{:^10}|{:^7}|{:^8}|{:^8}|{:^8}|{:^8}|{:^8}|{:^8}"
+summaryFormat = "{:^10}|{:>6} | {:<7}| {:<7}| {:<7}| {:<7}| {:<7}|{:>7}"
+measures = ("Ping", "Download", "Upload")
+Probe = namedtuple("Probe", ("DateTime Target Latency Jitter Loss"))
+probeHeader = "{:^14}|{:^22}|{:^8}|{:^8}|{:^6}"
+probeFormat = "{:^14}|{:<22}|{:>8}|{:>8}|{:>6}"
+quantiles = (0.05, 0.5, 0.95)
+archiveColumns = (("DateTime", "q"), ("Ping", "d"), ("Download", "d"), ("Upload", "d"))
 
 ##############################################################################80
 # Configurations
 ##############################################################################80
 storagePath = CONF["speedTest"]["storagePath"]
+aggregatePath = f"{storagePath}/summaries/today.json"
+recalcWorkers = CONF["speedTest"].get("workers", os.cpu_count())
+sketchAccuracy = 0.01  # relative error of percentiles
+sketchGamma = (1 + sketchAccuracy) / (1 - sketchAccuracy)
+sketchScale = math.log(sketchGamma)
+speedtestTimeout = CONF["speedTest"].get("timeout", 90)  # seconds
+builtinTester = args.builtin or CONF["speedTest"].get("tester") == "builtin"
+endpoints = CONF["speedTest"].get(
+    "endpoints",
+    {
+        "download": ["https://speed.cloudflare.com/__down?bytes=250000000"],
+        "upload": ["https://speed.cloudflare.com/__up"],
+    },
+)
+streamCount = CONF["speedTest"].get("streams", 4)
+streamDuration = CONF["speedTest"].get("duration", 8)  # seconds per direction
+streamTimeout = 5  # seconds to connect, or between chunks
+latencySamples = 10
+probeTargets = CONF["speedTest"].get(
+    "probeTargets", ["1.1.1.1:53", "8.8.8.8:53", "9.9.9.9:53"]
+)
+probeSamples = 5  # connects per target and minute
+probeTimeout = 2  # seconds before a connect counts as lost
+probeLossLimit = 20  # percent loss at which a target counts as degraded
+schedulePath = f"{storagePath}/schedule.json"
+minInterval = CONF["speedTest"].get("minInterval", 15)  # minutes
+baseInterval = CONF["speedTest"].get("interval", 60)  # minutes
+maxInterval = CONF["speedTest"].get("maxInterval", 240)  # minutes
+shortDuration = CONF["speedTest"].get("shortDuration", 3)  # seconds, built-in
+dailyBudget = CONF["speedTest"].get("dailyBudget", 5000) * 10**6  # MB to bytes
+baselinePath = f"{storagePath}/baseline.json"
+baselineWeight = CONF["speedTest"].get("baselineWeight", 0.2)  # EWMA alpha
+baselineThreshold = CONF["speedTest"].get("baselineThreshold", 3)  # in MADs
+baselineWarmup = 4  # tests in an hour of the week before it is trusted
+baselineFloor = 0.05  # smallest deviation, as a fraction of the mean
+reportPath = CONF["speedTest"].get("reportPath", f"{storagePath}/report")
+reportDays = 14
+reportWeeks = 12
+reportMonths = 12
+reportStyle = (
+    "body{font:14px sans-serif;margin:2em}figure{display:inline-block;margin:4px}"
+    "figcaption{font-size:12px}svg{background:#f6f6f6;display:block}"
+    "polyline{fill:none;stroke:#1565c0}polygon{fill:#90caf9;opacity:.6}"
+)
 
 
 ##############################################################################80
 # Run the speed test and return results
 ##############################################################################80
-def runSpeedTest():
+def runSpeedTest(duration=streamDuration):
     cPrint("Running speed test...", "BLUE") if args.debug else None
     if args.noscan:
         return {
@@ -74,16 +222,123 @@ def runSpeedTest():
             "upload": {"bandwidth": 2983970},
             "result": {"id": "Generated"},
         }
+    if builtinTester:
+        return runBuiltinTest(duration)
     try:
         result = subprocess.run(
-            "/usr/bin/speedtest -f json", shell=True, stdout=subprocess.PIPE
+            ["/usr/bin/speedtest", "-f", "json"],
+            stdout=subprocess.PIPE,
+            timeout=speedtestTimeout,
         )
         return json.loads(result.stdout.decode("utf-8"))
+    except subprocess.TimeoutExpired:
+        cPrint(f"Speed test timed out after {speedtestTimeout}s.", "RED")
+        sys.exit(1)
     except json.JSONDecodeError:
         cPrint("Error decoding speed test results.", "RED")
         sys.exit(1)
 
 
+##############################################################################80
+# Built-in tester: TCP connect latency and jitter, then parallel HTTP download
+# and upload streams for a bounded duration, reported as speedtest's JSON
+##############################################################################80
+def runBuiltinTest(duration):
+    cPrint("Running built-in speed test...", "BLUE") if args.debug else None
+    latency, jitter = sampleLatency(endpoints["download"][0])
+    download = measureStreams(downloadStream, endpoints["download"], duration)
+    upload = measureStreams(uploadStream, endpoints["upload"], duration)
+    return {
+        "ping": {"latency": latency, "jitter": jitter},
+        "download": download,
+        "upload": upload,
+        "result": {"id": "Builtin"},
+    }
+
+
+##############################################################################80
+# Median TCP connect time to the endpoint's host in ms, with jitter as the
+# mean difference between consecutive samples
+##############################################################################80
+def sampleLatency(url):
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    samples = []
+    for _ in range(latencySamples):
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((parts.hostname, port), streamTimeout):
+                samples.append((time.perf_counter() - start) * 1000)
+        except OSError:
+            continue
+
+    if not samples:
+        cPrint(f"Error connecting to {parts.hostname}:{port}.", "RED")
+        sys.exit(1)
+    return statistics.median(samples), jitterOf(samples)
+
+
+def jitterOf(samples):
+    differences = [abs(a - b) for a, b in zip(samples, samples[1:])]
+    return statistics.fmean(differences or [0])
+
+
+##############################################################################80
+# Run streamCount streams spread over the urls until duration has passed,
+# returning bytes moved and the combined bandwidth in bytes per second. Failed
+# streams move nothing, and a direction where all of them failed is an error.
+##############################################################################80
+def measureStreams(stream, urls, duration):
+    start = time.monotonic()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=streamCount) as pool:
+        futures = [
+            pool.submit(stream, urls[index % len(urls)], deadline)
+            for index in range(streamCount)
+        ]
+        transferred = sum(future.result() for future in futures)
+    if not transferred:
+        cPrint(f"Error streaming to or from {', '.join(urls)}.", "RED")
+        sys.exit(1)
+    bandwidth = transferred / (time.monotonic() - start)
+    return {"bandwidth": bandwidth, "bytes": transferred}
+
+
+def downloadStream(url, deadline):
+    received = 0
+    try:
+        # Bodies ending before the deadline are requested again
+        while time.monotonic() < deadline:
+            with requests.get(url, stream=True, timeout=streamTimeout) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(65536):
+                    received += len(chunk)
+                    if time.monotonic() >= deadline:
+                        break
+    except requests.RequestException as e:
+        cPrint(f"Download stream failed: {e}", "RED") if args.debug else None
+        return 0
+    return received
+
+
+def uploadStream(url, deadline):
+    sent = 0
+    chunk = os.urandom(65536)
+
+    def body():
+        nonlocal sent
+        while time.monotonic() < deadline:
+            sent += len(chunk)
+            yield chunk
+
+    try:
+        requests.post(url, data=body(), timeout=streamTimeout).raise_for_status()
+    except requests.RequestException as e:
+        cPrint(f"Upload stream failed: {e}", "RED") if args.debug else None
+        return 0
+    return sent
+
+
 ##############################################################################80
 # Helper: Convert bytes to Megabits.
 ##############################################################################80
@@ -97,182 +352,973 @@ def byteToMbits(bytes):
 def processCurrentTest(currentTest, date):
     cPrint("Processing hourly test...", "BLUE") if args.debug else None
     csvToday = f"{storagePath}/daily/{date}.csv"
-    allTests = []
+    appendTest(currentTest, csvToday)
+    return updateAggregates(currentTest, date)
 
-    # Read from CSV file all previous tests
-    if os.path.exists(csvToday) and os.stat(csvToday).st_size > 0:
-        with open(csvToday, mode="r") as reader:
-            # Create a DictReader, and then strip whitespace from the field names
-            readCSV = csv.DictReader(
-                (line.replace("\0", "") for line in reader), delimiter="|"
-            )
-            readCSV.fieldnames = [name.strip() for name in readCSV.fieldnames]
 
-            for row in readCSV:
-                cleanedRow = {k: v.strip() for k, v in row.items()}
-                allTests.append(SpeedTest(**cleanedRow))
+##############################################################################80
+# Short tests run while escalated read lower than full ones, so they are kept
+# apart in daily/YYYYMMDD.short.csv, with the tester and seconds they ran for
+##############################################################################80
+def processShortTest(currentTest, date, tester, seconds):
+    cPrint("Processing short test...", "BLUE") if args.debug else None
+    header = shortHeader.format(*ShortTest._fields)
+    row = shortFormat.format(*currentTest, tester, seconds)
+    appendRows(f"{storagePath}/daily/{date}.short.csv", header, [row])
+
 
-    # Append today's test
-    allTests.append(currentTest)
+##############################################################################80
+# Append a test to the day's CSV with a single write, so a crash can at worst
+# tear the row being written, never the rows before it
+##############################################################################80
+def appendTest(test, filepath):
+    header = testHeader.format(*SpeedTest._fields)
+    appendRows(filepath, header, [testFormat.format(*test)])
 
-    # Save all tests to CSV file
-    header = currentTest._fields
-    header = "{:^14}|{:^6}|{:^8}|{:^8}".format(*header).split("|", 0)
 
-    with open(csvToday, "w", newline="") as writer:
-        writeCSV = csv.writer(writer)
-        writeCSV.writerow(header)
+def appendRows(filepath, header, rows):
+    text = "".join(row + "\r\n" for row in rows)
+    appendSynced(filepath, text, header + "\r\n", "\r\n")
 
-        # Write data rows
-        for test in allTests:
-            test = "{:^14}|{:>5} | {:<7}|{:>7}".format(*test).split("|", 0)
-            writeCSV.writerow(test)
 
+##############################################################################80
+# Read a day's tests or probes from CSV, skipping rows torn by a crash
+# mid-append
+##############################################################################80
+def readTests(filepath, rowType=SpeedTest):
+    allTests = []
+    if not os.path.exists(filepath) or os.stat(filepath).st_size == 0:
+        return allTests
+
+    with open(filepath, mode="r", newline="") as reader:
+        # Columns are fixed, so rows are split directly below the header
+        lines = (line.replace("\0", "") for line in reader if line.endswith("\n"))
+        next(lines, None)
+        for line in lines:
+            fields = line.split("|")
+            if len(fields) == len(rowType._fields):
+                allTests.append(rowType(*map(str.strip, fields)))
     return allTests
 
 
 ##############################################################################80
-# Process current test into database and save to CSV file.
+# Probe targets concurrently every minute, appending one row per target to
+# probes/YYYYMMDD.csv; connects cost next to nothing while waiting on asyncio
 ##############################################################################80
-def createSummary(todaysTests, date):
-    sumPing, sumDownload, sumUpload = 0, 0, 0
-    minDownload, maxDownload = float("inf"), float("-inf")
-    minUpload, maxUpload = float("inf"), float("-inf")
-    numTests = len(todaysTests)
+def runProbes():
+    lineBuffered()
+    cPrint(f"Probing {len(probeTargets)} targets every minute...", "BLUE")
+    asyncio.run(probeLoop())
 
-    for test in todaysTests:
-        ping = float(test.Ping)
-        download = float(test.Download)
-        upload = float(test.Upload)
 
-        sumPing += ping
-        sumDownload += download
-        sumUpload += upload
+async def probeLoop():
+    while True:
+        await probeRound()
+        await asyncio.sleep(60 - time.time() % 60)
 
-        minDownload = min(download, minDownload)
-        maxDownload = max(download, maxDownload)
 
-        minUpload = min(upload, minUpload)
-        maxUpload = max(upload, maxUpload)
+async def probeRound():
+    probes = await asyncio.gather(*map(probeTarget, probeTargets))
+    rows = [probeFormat.format(*probe) for probe in probes]
+    os.makedirs(f"{storagePath}/probes", exist_ok=True)
+    probePath = f"{storagePath}/probes/{time.strftime('%Y%m%d')}.csv"
+    appendRows(probePath, probeHeader.format(*Probe._fields), rows)
+    if args.debug:
+        cPrint("\n".join(rows))
 
-    # Calculate averages and create the summary namedtuple.
-    averagePing = round(sumPing / numTests, 2) if numTests > 0 else 0
-    averageDownload = round(sumDownload / numTests, 2) if numTests > 0 else 0
-    averageUpload = round(sumUpload / numTests, 2) if numTests > 0 else 0
 
-    summary = DailySummary(
-        date,
-        averagePing,
-        round(minDownload, 2),
-        averageDownload,
-        round(maxDownload, 2),
-        round(minUpload, 2),
-        averageUpload,
-        round(maxUpload, 2),
+async def probeTarget(target):
+    host, port = target.rsplit(":", 1)
+    scanid, samples = time.strftime("%Y%m%d%H%M"), []
+    for _ in range(probeSamples):
+        start = time.perf_counter()
+        try:
+            connect = asyncio.open_connection(host, int(port))
+            _, writer = await asyncio.wait_for(connect, probeTimeout)
+            samples.append((time.perf_counter() - start) * 1000)
+            writer.close()
+        except (OSError, asyncio.TimeoutError):
+            pass
+        await asyncio.sleep(0.2)
+
+    loss = round(100 * (probeSamples - len(samples)) / probeSamples)
+    latency = round(statistics.median(samples), 2) if samples else 0
+    return Probe(scanid, target, latency, round(jitterOf(samples), 2), loss)
+
+
+##############################################################################80
+# Summarise the probes since a time per target, and whether the trouble looks
+# like the ISP (every target degraded) or single remote servers
+##############################################################################80
+def summarizeProbes(since):
+    probes, start = [], since.strftime("%Y%m%d%H%M")
+    for date in sorted({start[:8], time.strftime("%Y%m%d")}):
+        probePath = f"{storagePath}/probes/{date}.csv"
+        probes += readTests(probePath, Probe)
+    probes = [probe for probe in probes if probe.DateTime >= start]
+    if not probes:
+        return ""
+
+    targets, degraded = {}, []
+    for probe in probes:
+        targets.setdefault(probe.Target, []).append(probe)
+    lines = []
+    for target, rows in targets.items():
+        loss = statistics.fmean(float(row.Loss) for row in rows)
+        # Minutes without a single connect carry no latency
+        rows = [row for row in rows if float(row.Loss) < 100] or rows
+        latency = statistics.median(float(row.Latency) for row in rows)
+        jitter = statistics.fmean(float(row.Jitter) for row in rows)
+        lines.append(f"{target} {latency:.1f}ms ±{jitter:.1f} {loss:.0f}% loss")
+        if loss >= probeLossLimit:
+            degraded.append(target)
+
+    if degraded and len(degraded) == len(targets):
+        lines.append("All probe targets degraded, likely the ISP.")
+    elif degraded:
+        lines.append(f"Only {', '.join(degraded)} degraded, likely remote.")
+    return "\n".join(lines)
+
+
+##############################################################################80
+# Adaptive schedule in schedule.json: when the next test is due, its cadence,
+# and the bytes tested today against dailyBudget
+##############################################################################80
+def loadSchedule():
+    schedule = {"next": "", "interval": baseInterval, "escalated": False}
+    if os.path.exists(schedulePath):
+        with open(schedulePath, mode="r") as reader:
+            schedule.update(json.load(reader))
+    if schedule.get("date") != time.strftime("%Y%m%d"):
+        schedule.update(date=time.strftime("%Y%m%d"), spent=0)
+    return schedule
+
+
+##############################################################################80
+# Plan the next test: escalate to minInterval when a result is degraded,
+# otherwise back off towards maxInterval; and never faster than the rest of
+# the daily budget can pay for
+##############################################################################80
+def planNextTest(schedule, transferred, degraded):
+    if degraded:
+        interval = minInterval
+    elif schedule["escalated"]:
+        interval = minInterval * 2
+    else:
+        interval = min(schedule["interval"] * 2, maxInterval)
+
+    now = datetime.now()
+    spent = schedule["spent"] + transferred
+    minutesLeft = (24 - now.hour) * 60 - now.minute
+    if spent >= dailyBudget:
+        interval = max(interval, minutesLeft)
+    elif transferred:
+        affordable = (dailyBudget - spent) / transferred
+        interval = max(interval, round(minutesLeft / affordable))
+
+    schedule.update(
+        next=(now + timedelta(minutes=interval)).strftime("%Y%m%d%H%M"),
+        interval=min(interval, maxInterval),
+        escalated=degraded,
+        spent=spent,
     )
+    with open(f"{schedulePath}.temp", "w") as writer:
+        json.dump(schedule, writer)
+    os.replace(f"{schedulePath}.temp", schedulePath)
 
-    return summary
+    state = "escalated" if degraded else "steady"
+    cPrint(
+        f"Next test in {interval} minutes ({state}), "
+        f"{spent // 10**6}/{dailyBudget // 10**6} MB spent today.",
+        "BLUE",
+    )
 
 
 ##############################################################################80
-# Process current test into database and save to CSV file.
+# Baseline per hour of the week (168 slots) in baseline.json: per measure an
+# EWMA of the value and of its absolute deviation (MAD), folded in one test
+# at a time. Seeded once from the archive and the daily CSVs after it, up to
+# the test being checked, which is judged before it is folded in.
 ##############################################################################80
-def saveTodaysSummary(todaysSummary):
-    cPrint("Processing todays test...", "BLUE") if args.debug else None
-    csvAnnual = f"{storagePath}/summaries/{time.strftime('%Y')}.csv"
+def slotOf(dateTime):
+    moment = datetime.strptime(dateTime[:10], "%Y%m%d%H")
+    return str(moment.weekday() * 24 + moment.hour)
 
-    allSummaries = []
 
-    # Read from CSV file all previous tests
-    if os.path.exists(csvAnnual) and os.stat(csvAnnual).st_size > 0:
-        with open(csvAnnual, mode="r") as reader:
-            # Create a DictReader, and then strip whitespace from the field names
-            readCSV = csv.DictReader(
-                (line.replace("\0", "") for line in reader), delimiter="|"
+def storedTests():
+    columns = openArchive()
+    lastTime = columns["DateTime"][-1] if len(columns["DateTime"]) else 0
+    for index, dateTime in enumerate(columns["DateTime"]):
+        values = (columns[measure][index] for measure in measures)
+        yield SpeedTest(str(dateTime), *values)
+
+    lastDate = str(lastTime)[:8] if lastTime else ""
+    dailyPaths = sorted(
+        dailyPath
+        for dailyPath in glob.glob(f"{storagePath}/daily/*.csv")
+        if re.fullmatch(r"\d{8}\.csv", os.path.basename(dailyPath))
+        and lastDate <= os.path.basename(dailyPath)[:8]
+    )
+    for dailyPath in dailyPaths:
+        for test in readTests(dailyPath):
+            if int(test.DateTime) > lastTime:
+                yield test
+
+
+def loadBaseline(before):
+    if os.path.exists(baselinePath):
+        with open(baselinePath, mode="r") as reader:
+            return json.load(reader)
+
+    cPrint("Seeding baseline from stored tests...", "BLUE") if args.debug else None
+    baseline = {"updated": "", "slots": {}}
+    for test in storedTests():
+        if test.DateTime < before:
+            foldBaseline(baseline, test)
+    return baseline
+
+
+def foldBaseline(baseline, test):
+    if test.DateTime <= baseline["updated"]:
+        return baseline
+    slot = baseline["slots"].setdefault(slotOf(test.DateTime), {})
+    for measure in measures:
+        value = float(getattr(test, measure))
+        stats = slot.setdefault(measure, {"mean": value, "mad": 0, "count": 0})
+        if stats["count"] >= baselineWarmup:
+            # Outliers are clamped, so an outage does not drag the baseline
+            bound = baselineThreshold * spreadOf(stats)
+            value = min(max(value, stats["mean"] - bound), stats["mean"] + bound)
+
+        # Plain averages until warm, so the first tests weigh in equally
+        stats["count"] += 1
+        weight = max(baselineWeight, 1 / stats["count"])
+        stats["mad"] += weight * (abs(value - stats["mean"]) - stats["mad"])
+        stats["mean"] += weight * (value - stats["mean"])
+    baseline["updated"] = test.DateTime
+    return baseline
+
+
+def spreadOf(stats):
+    return max(stats["mad"], stats["mean"] * baselineFloor)
+
+
+##############################################################################80
+# Compare a test to the baseline of its hour of the week, before folding it
+# in. Returns the deviations found, or None while the hour is still warming up.
+##############################################################################80
+def checkBaseline(test):
+    baseline = loadBaseline(test.DateTime)
+    slot = baseline["slots"].get(slotOf(test.DateTime), {})
+    counts = [slot.get(measure, {}).get("count", 0) for measure in measures]
+    deviations = deviationsOf(slot, test) if min(counts) >= baselineWarmup else None
+
+    foldBaseline(baseline, test)
+    with open(f"{baselinePath}.temp", "w") as writer:
+        writer.write(json.dumps(baseline))
+    os.replace(f"{baselinePath}.temp", baselinePath)
+    return deviations
+
+
+def deviationsOf(slot, test):
+    deviations = []
+    for measure in measures:
+        stats, value = slot[measure], float(getattr(test, measure))
+        score = (value - stats["mean"]) / spreadOf(stats)
+        # Lower speeds and higher pings are the deviations that matter
+        if (-score if measure == "Ping" else score) < -baselineThreshold:
+            deviations.append(
+                f"{measure} {value} vs {round(stats['mean'], 2)}"
+                f"±{round(spreadOf(stats), 2)} usual ({score:+.1f} MAD)"
             )
-            readCSV.fieldnames = [name.strip() for name in readCSV.fieldnames]
+    return deviations
 
-            for row in readCSV:
-                cleanedRow = {k: v.strip() for k, v in row.items()}
-                rowSummary = DailySummary(**cleanedRow)
-                if rowSummary.Date != todaysSummary.Date:
-                    allSummaries.append(rowSummary)
 
-    # Read from CSV file all previous tests
-    allSummaries.append(todaysSummary)
+##############################################################################80
+# Print a readable view of a day's tests followed by its summary
+##############################################################################80
+def viewDay(date):
+    allTests = readTests(f"{storagePath}/daily/{date}.csv")
+    if not allTests:
+        cPrint(f"No tests recorded on {date}.", "RED")
+        return
+
+    print(testHeader.format(*SpeedTest._fields))
+    for test in allTests:
+        print(testFormat.format(*test))
 
-    # Save all tests to CSV file
-    header = todaysSummary._fields
-    header = "{:^10}|{:^7}|{:^8}|{:^8}|{:^8}|{:^8}|{:^8}|{:^8}".format(*header).split(
-        "|", 0
+    aggregates = aggregateTests(allTests, date)
+    summary = createSummary(aggregates)
+    download, upload = aggregates["Download"], aggregates["Upload"]
+    print(
+        f"{len(allTests)} tests, ping {summary.AvgPing}ms, "
+        f"down {summary.MinDown}/{summary.AvgDown}/{summary.MaxDown} "
+        f"sd {deviationOf(download)}, "
+        f"up {summary.MinUp}/{summary.AvgUp}/{summary.MaxUp} "
+        f"sd {deviationOf(upload)} (min/avg/max Mbps)"
     )
+    spreads = []
+    for measure in measures:
+        sketch = aggregates[measure]["sketch"]
+        spread = "/".join(str(quantileOf(sketch, q)) for q in quantiles)
+        spreads.append(f"{measure.lower()} {spread}")
+    print(", ".join(spreads) + " (p5/p50/p95)")
+
+
+##############################################################################80
+# Percentile sketches bucket values on a log scale, so each bucket spans a
+# fixed relative error; sketches of days merge into months and years by
+# adding bucket counts. Keys are strings, as they are stored in JSON.
+##############################################################################80
+def sketchAdd(sketch, value):
+    key = str(math.ceil(math.log(value) / sketchScale)) if value > 0 else "zero"
+    sketch[key] = sketch.get(key, 0) + 1
+    return sketch
+
+
+def mergeSketches(sketches):
+    merged = {}
+    for sketch in sketches:
+        for key, count in sketch.items():
+            merged[key] = merged.get(key, 0) + count
+    return merged
+
 
-    with open(csvAnnual, "w", newline="") as writer:
-        writeCSV = csv.writer(writer)
-        writeCSV.writerow(header)
+def quantileOf(sketch, quantile):
+    rank = quantile * (sum(sketch.values()) - 1)
+    seen = 0
+    for key in sorted(sketch, key=lambda k: -math.inf if k == "zero" else int(k)):
+        seen += sketch[key]
+        if seen > rank:
+            if key == "zero":
+                return 0
+            return round(2 * sketchGamma ** int(key) / (sketchGamma + 1), 2)
+    return 0
 
-        # Write data rows
-        for test in allSummaries:
-            test = "{:^10}|{:>6} | {:<7}| {:<7}| {:<7}| {:<7}| {:<7}|{:>7}".format(
-                *test
-            ).split("|", 0)
-            writeCSV.writerow(test)
+
+##############################################################################80
+# Running aggregates of a day, per measure the count, sum, min, max, sum of
+# squares and percentile sketch; persisted so each hourly test is folded in
+# with O(1) work
+##############################################################################80
+def newAggregates(date):
+    aggregates = {"date": date}
+    for measure in measures:
+        aggregates[measure] = {
+            "count": 0,
+            "sum": 0,
+            "min": 0,
+            "max": 0,
+            "sumsq": 0,
+            "sketch": {},
+        }
+    return aggregates
+
+
+def foldTest(aggregates, test):
+    for measure in measures:
+        value = float(getattr(test, measure))
+        stats = aggregates[measure]
+        if stats["count"] == 0:
+            stats["min"] = stats["max"] = value
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["sumsq"] += value * value
+        stats["min"] = min(value, stats["min"])
+        stats["max"] = max(value, stats["max"])
+        sketchAdd(stats["sketch"], value)
+    return aggregates
+
+
+def aggregateTests(allTests, date):
+    # Whole columns at once, summed in order so results match foldTest
+    aggregates = newAggregates(date)
+    if not allTests:
+        return aggregates
+    for measure, column in zip(measures, list(zip(*allTests))[1:]):
+        values = list(map(float, column))
+        aggregates[measure] = {
+            "count": len(values),
+            "sum": reduce(add, values, 0),
+            "min": min(values),
+            "max": max(values),
+            "sumsq": reduce(add, map(mul, values, values), 0),
+            "sketch": reduce(sketchAdd, values, {}),
+        }
+    return aggregates
+
+
+def averageOf(stats):
+    return round(stats["sum"] / stats["count"], 2) if stats["count"] > 0 else 0
+
+
+def deviationOf(stats):
+    if stats["count"] == 0:
+        return 0
+    mean = stats["sum"] / stats["count"]
+    return round(math.sqrt(max(stats["sumsq"] / stats["count"] - mean**2, 0)), 2)
 
 
 ##############################################################################80
 # Process current test into database and save to CSV file.
 ##############################################################################80
-def recalcAllSummaries(year):
-    cPrint("Recalculating all summaries...", "BLUE") if args.debug else None
-    csvAnnual = f"{storagePath}/summaries/{year}.csv"
-    dailyFolder = f"{storagePath}/daily/"
+def createSummary(aggregates):
+    ping = aggregates["Ping"]
+    download = aggregates["Download"]
+    upload = aggregates["Upload"]
 
+    summary = DailySummary(
+        aggregates["date"],
+        averageOf(ping),
+        round(download["min"], 2),
+        averageOf(download),
+        round(download["max"], 2),
+        round(upload["min"], 2),
+        averageOf(upload),
+        round(upload["max"], 2),
+    )
+
+    return summary
+
+
+##############################################################################80
+# Fold the current test into today's aggregates. A stored day other than today
+# has finished, its summary is appended to its annual CSV before starting anew
+##############################################################################80
+def updateAggregates(currentTest, date):
+    cPrint("Updating todays summary...", "BLUE") if args.debug else None
+    aggregates = None
+    if os.path.exists(aggregatePath):
+        with open(aggregatePath, mode="r") as reader:
+            aggregates = json.load(reader)
+
+    # Aggregates stored without sketches are rebuilt from their day's CSV
+    if aggregates and "sketch" not in aggregates["Ping"]:
+        stored = aggregates["date"]
+        allTests = readTests(f"{storagePath}/daily/{stored}.csv")
+        aggregates = aggregateTests(allTests, stored)
+
+    if aggregates and aggregates["date"] != date:
+        saveSummary(createSummary(aggregates))
+        sketches = loadSketches(aggregates["date"][:4])
+        sketches[aggregates["date"]] = sketchesOf(aggregates)
+        saveSketches(aggregates["date"][:4], sketches)
+        aggregates = None
+
+    if aggregates is None:
+        # Seeded from the day's CSV, which already holds the current test
+        allTests = readTests(f"{storagePath}/daily/{date}.csv")
+        aggregates = aggregateTests(allTests, date)
+    else:
+        foldTest(aggregates, currentTest)
+
+    with open(f"{aggregatePath}.temp", "w") as writer:
+        json.dump(aggregates, writer)
+    os.replace(f"{aggregatePath}.temp", aggregatePath)
+    return aggregates
+
+
+##############################################################################80
+# Append a finished day to its annual CSV, replacing the last row if it holds
+# the same day, as written by a recalculation
+##############################################################################80
+def saveSummary(summary):
+    cPrint(f"Saving summary of {summary.Date}...", "BLUE") if args.debug else None
+    csvAnnual = f"{storagePath}/summaries/{summary.Date[:4]}.csv"
+    row = summaryFormat.format(*summary) + "\r\n"
+
+    with open(csvAnnual, "a+b") as writer:
+        size = writer.seek(0, os.SEEK_END)
+        if size == 0:
+            row = summaryHeader.format(*DailySummary._fields) + "\r\n" + row
+        else:
+            writer.seek(max(size - 256, 0))
+            tail = writer.read()
+            last = tail.rfind(b"\n", 0, len(tail) - 1) + 1
+            if tail[last:].strip().startswith(summary.Date.encode("utf-8")):
+                writer.truncate(size - len(tail) + last)
+            elif not tail.endswith(b"\n"):
+                row = "\r\n" + row
+        writer.write(row.encode("utf-8"))
+
+
+##############################################################################80
+# Daily percentile sketches of a year, kept next to its annual CSV as
+# summaries/YYYY.sketches.json keyed by date
+##############################################################################80
+def sketchesOf(aggregates):
+    return {measure: aggregates[measure].get("sketch", {}) for measure in measures}
+
+
+def loadSketches(year):
+    sketchPath = f"{storagePath}/summaries/{year}.sketches.json"
+    if not os.path.exists(sketchPath):
+        return {}
+    with open(sketchPath, mode="r") as reader:
+        return json.load(reader)
+
+
+def saveSketches(year, sketches):
+    sketchPath = f"{storagePath}/summaries/{year}.sketches.json"
+    with open(f"{sketchPath}.temp", "w") as writer:
+        writer.write(json.dumps(dict(sorted(sketches.items())), separators=(",", ":")))
+    os.replace(f"{sketchPath}.temp", sketchPath)
+
+
+##############################################################################80
+# Print p5/p50/p95 from merged sketches per month and year of a range, and per
+# day when it spans a month or less; today comes from its running aggregates
+##############################################################################80
+def showPercentiles(first, last):
+    days = loadDaySketches(first, last)
+    if not days:
+        cPrint(f"No percentile sketches from {first} to {last}.", "RED")
+        return
+
+    periods = {}
+    for length in (8, 6, 4) if len(days) <= 31 else (6, 4):
+        for date in sorted(days):
+            periods.setdefault(date[:length], []).append(days[date])
+
+    print(" | ".join(["Period  "] + [f"{measure:^23}" for measure in measures]))
+    for period, sketches in periods.items():
+        row = [f"{period:<8}"]
+        for measure in measures:
+            merged = mergeSketches(sketch[measure] for sketch in sketches)
+            row.append(" ".join(f"{quantileOf(merged, q):>7}" for q in quantiles))
+        print(" | ".join(row))
+    print("Percentiles are p5 p50 p95, ping in ms and speeds in Mbps.")
+
+
+def loadDaySketches(first, last):
+    days = {}
+    for year in range(int(first[:4]), int(last[:4]) + 1):
+        for date, sketches in loadSketches(year).items():
+            if first <= date <= last:
+                days[date] = sketches
+    if os.path.exists(aggregatePath):
+        with open(aggregatePath, mode="r") as reader:
+            aggregates = json.load(reader)
+        if first <= aggregates["date"] <= last:
+            days[aggregates["date"]] = sketchesOf(aggregates)
+    return days
+
+
+##############################################################################80
+# Aggregate one daily CSV, run in worker processes during recalculation
+##############################################################################80
+def summarizeDay(dailyPath):
+    date = os.path.basename(dailyPath)[:8]
+    aggregates = aggregateTests(readTests(dailyPath), date)
+    return aggregates if aggregates["Ping"]["count"] else None
+
+
+##############################################################################80
+# Read a year of daily summaries from its annual CSV
+##############################################################################80
+def readSummaries(filepath):
     allSummaries = []
+    if not os.path.exists(filepath) or os.stat(filepath).st_size == 0:
+        return allSummaries
 
-    # for root, dirs, files in os.walk(dailyFolder):
-    pattern = f"{year}*.csv"  # Pattern for files like '2023xxxx.csv'
-    for dailyPath in glob.glob(os.path.join(dailyFolder, pattern)):
-        # Read from CSV file all previous tests
-        if os.stat(dailyPath).st_size == 0:
-            continue
+    with open(filepath, mode="r", newline="") as reader:
+        lines = (line.replace("\0", "") for line in reader if line.endswith("\n"))
+        next(lines, None)
+        for line in lines:
+            fields = line.split("|")
+            if len(fields) == len(DailySummary._fields):
+                allSummaries.append(DailySummary(*map(str.strip, fields)))
+    return allSummaries
 
-        allTests = []
-        date = re.search(r"(\d{4}\d{2}\d{2})", dailyPath).group(1)
 
-        with open(dailyPath, mode="r") as reader:
-            # Create a DictReader, and then strip whitespace from the field names
-            readCSV = csv.DictReader(
-                (line.replace("\0", "") for line in reader), delimiter="|"
-            )
-            readCSV.fieldnames = [name.strip() for name in readCSV.fieldnames]
+##############################################################################80
+# Recalculate the summaries of all days from first to last (YYYYMMDD), parsing
+# daily CSVs in a process pool; annual rows outside the range are kept
+##############################################################################80
+def recalcAllSummaries(first, last, workers=recalcWorkers):
+    cPrint("Recalculating all summaries...", "BLUE") if args.debug else None
+    dailyPaths = sorted(
+        dailyPath
+        for dailyPath in glob.glob(f"{storagePath}/daily/*.csv")
+        if re.fullmatch(r"\d{8}\.csv", os.path.basename(dailyPath))
+        and first <= os.path.basename(dailyPath)[:8] <= last
+        and os.stat(dailyPath).st_size > 0
+    )
+
+    if workers > 1 and len(dailyPaths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(summarizeDay, dailyPaths, chunksize=64))
+    else:
+        results = list(map(summarizeDay, dailyPaths))
 
-            for row in readCSV:
-                cleanedRow = {k: v.strip() for k, v in row.items()}
-                allTests.append(SpeedTest(**cleanedRow))
+    years = {}
+    for aggregates in filter(None, results):
+        years.setdefault(aggregates["date"][:4], []).append(aggregates)
 
-        currentSummary = createSummary(allTests, date)
-        allSummaries.append(currentSummary)
+    for year, allAggregates in years.items():
+        sketches = loadSketches(year)
+        for date in [date for date in sketches if first <= date <= last]:
+            del sketches[date]
+        for aggregates in allAggregates:
+            sketches[aggregates["date"]] = sketchesOf(aggregates)
+        saveSketches(year, sketches)
 
-    allSummaries = sorted(allSummaries, key=lambda x: x.Date)
+        allSummaries = list(map(createSummary, allAggregates))
+        csvAnnual = f"{storagePath}/summaries/{year}.csv"
+        kept = [
+            summary
+            for summary in readSummaries(csvAnnual)
+            if not first <= summary.Date <= last
+        ]
+        allSummaries = sorted(kept + allSummaries, key=lambda x: x.Date)
 
-    # Save all tests to CSV file
-    header = allSummaries[0]._fields
-    header = "{:^10}|{:^7}|{:^8}|{:^8}|{:^8}|{:^8}|{:^8}|{:^8}".format(*header).split(
-        "|", 0
+        # Save all tests to CSV file
+        header = allSummaries[0]._fields
+        header = summaryHeader.format(*header).split("|", 0)
+
+        with open(csvAnnual, "w", newline="") as writer:
+            writeCSV = csv.writer(writer)
+            writeCSV.writerow(header)
+
+            # Write data rows
+            for test in allSummaries:
+                test = summaryFormat.format(*test).split("|", 0)
+                writeCSV.writerow(test)
+
+    return [createSummary(aggregates) for aggregates in results if aggregates]
+
+
+##############################################################################80
+# Expand a date range of YYYY or YYYYMMDD, or two joined by a dash,
+# into the first and last day it covers
+##############################################################################80
+def dateRange(text):
+    match = re.fullmatch(r"(\d{4}|\d{8})(?:-(\d{4}|\d{8}))?", text)
+    if not match:
+        cPrint(f"Invalid date range: {text}", "RED")
+        sys.exit(1)
+    first, last = match.group(1), match.group(2) or match.group(1)
+    first = first + "0101" if len(first) == 4 else first
+    last = last + "1231" if len(last) == 4 else last
+    return first, last
+
+
+##############################################################################80
+# Columnar archive of closed days in archive/, one file of 8 byte values per
+# SpeedTest field, DateTime as an integer. DateTime is appended last, so rows
+# beyond its length are an interrupted compaction and are cut back.
+##############################################################################80
+def archiveRows():
+    sizes = []
+    for column, code in archiveColumns:
+        columnPath = f"{storagePath}/archive/{column}.bin"
+        sizes.append(os.path.getsize(columnPath) if os.path.exists(columnPath) else 0)
+    return min(sizes) // 8
+
+
+def compactArchive(today):
+    cPrint("Compacting closed days into archive...", "BLUE") if args.debug else None
+    os.makedirs(f"{storagePath}/archive", exist_ok=True)
+    rows, lastTime = archiveRows(), 0
+    for column, code in archiveColumns:
+        with open(f"{storagePath}/archive/{column}.bin", "ab") as writer:
+            writer.truncate(rows * 8)
+    if rows:
+        with open(f"{storagePath}/archive/DateTime.bin", "rb") as reader:
+            reader.seek((rows - 1) * 8)
+            lastTime = array("q", reader.read(8))[0]
+
+    # The last archived day is read again in case it was cut back
+    lastDate = str(lastTime)[:8] if rows else ""
+    dailyPaths = sorted(
+        dailyPath
+        for dailyPath in glob.glob(f"{storagePath}/daily/*.csv")
+        if re.fullmatch(r"\d{8}\.csv", os.path.basename(dailyPath))
+        and lastDate <= os.path.basename(dailyPath)[:8] < today
     )
 
-    with open(csvAnnual, "w", newline="") as writer:
-        writeCSV = csv.writer(writer)
-        writeCSV.writerow(header)
+    columns = {column: array(code) for column, code in archiveColumns}
+    for dailyPath in dailyPaths:
+        for test in readTests(dailyPath):
+            if int(test.DateTime) <= lastTime:
+                continue
+            columns["DateTime"].append(int(test.DateTime))
+            for measure in measures:
+                columns[measure].append(float(getattr(test, measure)))
 
-        # Write data rows
-        for test in allSummaries:
-            test = "{:^10}|{:>6} | {:<7}| {:<7}| {:<7}| {:<7}| {:<7}|{:>7}".format(
-                *test
-            ).split("|", 0)
-            writeCSV.writerow(test)
+    for column, code in reversed(archiveColumns):
+        with open(f"{storagePath}/archive/{column}.bin", "ab") as writer:
+            columns[column].tofile(writer)
+            writer.flush()
+            os.fsync(writer.fileno())
 
-    return allSummaries
+    added = len(columns["DateTime"])
+    cPrint(f"Archived {added} tests from {len(dailyPaths)} days.", "BLUE")
+    return added
+
+
+##############################################################################80
+# Map the archive read-only, returning each column as a typed memoryview
+##############################################################################80
+def openArchive():
+    rows = archiveRows()
+    columns = {}
+    for column, code in archiveColumns:
+        if rows == 0:
+            columns[column] = memoryview(array(code))
+            continue
+        with open(f"{storagePath}/archive/{column}.bin", "rb") as reader:
+            mapped = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        columns[column] = memoryview(mapped)[: rows * 8].cast(code)
+    return columns
+
+
+##############################################################################80
+# Slices of every archive column holding the tests from first to last day
+##############################################################################80
+def queryArchive(first, last):
+    columns = openArchive()
+    start = bisect.bisect_left(columns["DateTime"], int(first + "0000"))
+    end = bisect.bisect_right(columns["DateTime"], int(last + "2359"))
+    return {column: view[start:end] for column, view in columns.items()}
+
+
+##############################################################################80
+# Print the min/avg/max of each measure over a range of archived tests
+##############################################################################80
+def showHistory(first, last):
+    columns = queryArchive(first, last)
+    count = len(columns["DateTime"])
+    if count == 0:
+        cPrint(f"No archived tests from {first} to {last}.", "RED")
+        return
+
+    spreads = []
+    for measure in measures:
+        values = columns[measure]
+        average = round(sum(values) / count, 2)
+        spread = f"{round(min(values), 2)}/{average}/{round(max(values), 2)}"
+        spreads.append(f"{measure.lower()} {spread}")
+    print(f"{count} tests from {columns['DateTime'][0]} to {columns['DateTime'][-1]}")
+    print(", ".join(spreads) + " (min/avg/max)")
+
+
+##############################################################################80
+# Static HTML report in reportPath, assembled from cached tiles of days, weeks
+# and months. A tile is rendered again only if its period had not ended when
+# it was last rendered, so an hourly run redraws today, this week and month.
+##############################################################################80
+def renderReport(today):
+    cPrint("Rendering report...", "BLUE") if args.debug else None
+    os.makedirs(f"{reportPath}/tiles", exist_ok=True)
+    now = datetime.strptime(today, "%Y%m%d")
+    days = [
+        (now - timedelta(days=offset)).strftime("%Y%m%d")
+        for offset in range(reportDays)
+    ]
+    periods, month = [], now.replace(day=1)
+    for offset in range(reportWeeks):
+        monday = now - timedelta(days=now.weekday() + 7 * offset)
+        sunday = monday + timedelta(days=6)
+        year, week, _ = monday.isocalendar()
+        periods.append((f"W{year}-{week:02}", f"{monday:%Y%m%d}", f"{sunday:%Y%m%d}"))
+    for offset in range(reportMonths):
+        nextMonth = (month + timedelta(days=31)).replace(day=1)
+        lastDay = nextMonth - timedelta(days=1)
+        periods.append((f"M{month:%Y%m}", f"{month:%Y%m%d}", f"{lastDay:%Y%m%d}"))
+        month = (month - timedelta(days=1)).replace(day=1)
+
+    rendered = 0
+    for date in days:
+        rendered += renderTile(f"D{date}", date, dayTile, date)
+        rendered += renderTile(f"O{date}", date, outageTile, date)
+    for name, first, last in periods:
+        rendered += renderTile(name, last, periodTile, name, first, last)
+
+    outages = "".join(readTile(f"O{date}") for date in days)
+    sections = [
+        ("Days", [f"D{date}" for date in days]),
+        ("Weeks", [name for name, _, _ in periods[:reportWeeks]]),
+        ("Months", [name for name, _, _ in periods[reportWeeks:]]),
+    ]
+    page = [
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+        f"<title>ISP Report {today}</title><style>{reportStyle}</style></head>",
+        f"<body><h1>ISP Report</h1><p>Updated {SCANID}, speeds in Mbps.</p>",
+    ]
+    for title, names in sections:
+        page.append(f"<h2>{title}</h2>" + "".join(map(readTile, names)))
+    page.append(f"<h2>Outages</h2><ul>{outages or '<li>None</li>'}</ul></body></html>")
+
+    with open(f"{reportPath}/index.html.temp", "w") as writer:
+        writer.write("\n".join(page))
+    os.replace(f"{reportPath}/index.html.temp", f"{reportPath}/index.html")
+    cPrint(f"Rendered {rendered} report tiles.", "BLUE") if args.debug else None
+
+
+def renderTile(name, lastDay, render, *renderArgs):
+    tilePath = f"{reportPath}/tiles/{name}.html"
+    if os.path.exists(tilePath):
+        renderedOn = time.localtime(os.path.getmtime(tilePath))
+        if time.strftime("%Y%m%d", renderedOn) > lastDay:
+            return 0
+    with open(f"{tilePath}.temp", "w") as writer:
+        writer.write(render(*renderArgs))
+    os.replace(f"{tilePath}.temp", tilePath)
+    return 1
+
+
+def readTile(name):
+    tilePath = f"{reportPath}/tiles/{name}.html"
+    if not os.path.exists(tilePath):
+        return ""
+    with open(tilePath, mode="r") as reader:
+        return reader.read()
+
+
+##############################################################################80
+# Tiles: a day's tests over its minutes, a week or month as daily p5-p95 bands
+# around the p50 from the sketches, and a day's outages as list items
+##############################################################################80
+def dayTile(date):
+    allTests = readTests(f"{storagePath}/daily/{date}.csv")
+    if not allTests:
+        return f"<figure><figcaption>{date}: no tests</figcaption></figure>"
+
+    minutes = [minuteOf(test.DateTime) for test in allTests]
+    aggregates = aggregateTests(allTests, date)
+    charts = []
+    for measure in ("Download", "Upload"):
+        values = [float(getattr(test, measure)) for test in allTests]
+        stats = aggregates[measure]
+        spread = f"{round(stats['min'], 2)}/{averageOf(stats)}/{round(stats['max'], 2)}"
+        charts.append(f"{sparkline(minutes, values, 1440)}{measure} {spread}<br>")
+    caption = f"{date}: {len(allTests)} tests, ping {averageOf(aggregates['Ping'])}ms"
+    return f"<figure>{''.join(charts)}<figcaption>{caption}</figcaption></figure>"
+
+
+def periodTile(name, first, last):
+    days = loadDaySketches(first, last)
+    if not days:
+        return f"<figure><figcaption>{name}: no tests</figcaption></figure>"
+
+    start = datetime.strptime(first, "%Y%m%d")
+    span = (datetime.strptime(last, "%Y%m%d") - start).days
+    dates = sorted(days)
+    offsets = [(datetime.strptime(date, "%Y%m%d") - start).days for date in dates]
+    charts = []
+    for measure in ("Download", "Upload"):
+        sketches = [days[date][measure] for date in dates]
+        lows, medians, highs = (
+            [quantileOf(sketch, quantile) for sketch in sketches]
+            for quantile in quantiles
+        )
+        merged = mergeSketches(sketches)
+        spread = "/".join(str(quantileOf(merged, quantile)) for quantile in quantiles)
+        chart = sparkline(offsets, medians, span, (lows, highs))
+        charts.append(f"{chart}{measure} {spread}<br>")
+    caption = f"{name[1:]}: {len(days)} days, p5/p50/p95"
+    return f"<figure>{''.join(charts)}<figcaption>{caption}</figcaption></figure>"
+
+
+def outageTile(date):
+    items = []
+    for test in readTests(f"{storagePath}/daily/{date}.csv"):
+        if (
+            float(test.Download) < CONF["speedTest"]["minDownload"]
+            or float(test.Upload) < CONF["speedTest"]["minUpload"]
+        ):
+            moment = f"{test.DateTime[8:10]}:{test.DateTime[10:12]}"
+            speeds = f"D{test.Download}, U{test.Upload}"
+            items.append(f"<li>{date} {moment} under bounds: {speeds}</li>")
+
+    # Minutes in which every probe target was lost, joined into spans
+    probes = {}
+    for probe in readTests(f"{storagePath}/probes/{date}.csv", Probe):
+        probes.setdefault(probe.DateTime, []).append(float(probe.Loss) >= 100)
+    spans = []
+    for dateTime in sorted(dateTime for dateTime, lost in probes.items() if all(lost)):
+        minute = minuteOf(dateTime)
+        if spans and spans[-1][1] == minute - 1:
+            spans[-1][1] = minute
+        else:
+            spans.append([minute, minute])
+    for start, end in spans:
+        period = f"{start // 60:02}:{start % 60:02}-{end // 60:02}:{end % 60:02}"
+        items.append(f"<li>{date} {period} all probe targets lost</li>")
+    return "".join(items)
+
+
+def minuteOf(dateTime):
+    return int(dateTime[8:10]) * 60 + int(dateTime[10:12])
+
+
+def sparkline(offsets, values, span, band=None, width=240, height=40):
+    bottom, top = min(band[0] if band else values), max(band[1] if band else values)
+
+    def point(offset, value):
+        x = offset / max(span, 1) * width
+        y = height - (value - bottom) / ((top - bottom) or 1) * height
+        return f"{x:.1f},{y:.1f}"
+
+    svg = f"<svg viewBox='0 0 {width} {height}' width='{width}' height='{height}'>"
+    if band:
+        lows, highs = band
+        outline = list(map(point, offsets, highs))
+        outline += list(map(point, reversed(offsets), reversed(lows)))
+        svg += f"<polygon points='{' '.join(outline)}'/>"
+    return svg + f"<polyline points='{' '.join(map(point, offsets, values))}'/></svg>"
+
+
+##############################################################################80
+# Time recalculation of years of generated hourly tests, serial and pooled,
+# checking both write the same annual summaries
+##############################################################################80
+def benchRecalc(years):
+    global storagePath
+    storagePath = tempfile.mkdtemp(prefix="checkISP.")
+    os.makedirs(f"{storagePath}/daily")
+    os.makedirs(f"{storagePath}/summaries")
+    random.seed(years)
+
+    day = datetime(datetime.now().year - years, 1, 1)
+    while day.year < datetime.now().year:
+        rows = [testHeader.format(*SpeedTest._fields)]
+        for hour in range(24):
+            test = SpeedTest(
+                day.strftime("%Y%m%d") + f"{hour:02}04",
+                round(random.uniform(5, 40), 2),
+                round(random.uniform(20, 900), 2),
+                round(random.uniform(1, 40), 2),
+            )
+            rows.append(testFormat.format(*test))
+        with open(f"{storagePath}/daily/{day.strftime('%Y%m%d')}.csv", "w") as writer:
+            writer.write("\r\n".join(rows) + "\r\n")
+        day += timedelta(days=1)
+
+    first, last = dateRange(f"{datetime.now().year - years}-{day.year - 1}")
+    outputs = []
+    for workers in (1, max(recalcWorkers, 2)):
+        start = time.perf_counter()
+        summaries = recalcAllSummaries(first, last, workers)
+        elapsed = time.perf_counter() - start
+        print(f"{workers:>3} workers: {len(summaries)} days in {elapsed:.3f}s")
+
+        outputs.append({})
+        for csvAnnual in sorted(glob.glob(f"{storagePath}/summaries/*")):
+            with open(csvAnnual, mode="r") as reader:
+                outputs[-1][csvAnnual] = reader.read()
+            os.remove(csvAnnual)
+
+    for dailyPath in glob.glob(f"{storagePath}/daily/*.csv"):
+        os.remove(dailyPath)
+    os.rmdir(f"{storagePath}/daily")
+    os.rmdir(f"{storagePath}/summaries")
+    os.rmdir(storagePath)
+
+    verdict = "identical" if outputs[0] == outputs[-1] else "DIFFERENT"
+    cPrint(f"Serial and pooled summaries are {verdict}.")
+    return outputs[0] == outputs[-1]
 
 
 ##############################################################################80
@@ -280,32 +1326,95 @@ def recalcAllSummaries(year):
 ##############################################################################80
 def main():
     cPrint(f"Beginning main execution...", "BLUE") if args.debug else None
+    if args.view:
+        viewDay(args.view)
+        sys.exit(0)
+
+    if args.probe:
+        runProbes()
+
+    if args.bench:
+        sys.exit(0 if benchRecalc(args.bench) else 1)
+    if args.percentiles:
+        showPercentiles(*dateRange(args.percentiles))
+        sys.exit(0)
+
+    if args.compact:
+        compactArchive(time.strftime("%Y%m%d"))
+        sys.exit(0)
 
-    currentTest = runSpeedTest()
+    if args.history:
+        showHistory(*dateRange(args.history))
+        sys.exit(0)
+
+    if args.report:
+        renderReport(time.strftime("%Y%m%d"))
+        sys.exit(0)
+    recalc = dateRange(args.recalc) if args.recalc else None
+
+    # Between scheduled tests only cheap probes run, and only when escalated
+    schedule = loadSchedule() if args.schedule else None
+    if schedule and SCANID < schedule["next"]:
+        cPrint(f"Next test due at {schedule['next']}.", "BLUE") if args.debug else None
+        asyncio.run(probeRound()) if schedule["escalated"] else None
+        pingHealth()
+        sys.exit(0)
+
+    # speedtest sets its own length, so only the built-in tester runs short
+    escalated = schedule and schedule["escalated"]
+    short = escalated and builtinTester and shortDuration < streamDuration
+    duration = shortDuration if short else streamDuration
+    currentTest = runSpeedTest(duration)
     ping = round(currentTest["ping"]["latency"], 2)
     download = byteToMbits(currentTest["download"]["bandwidth"])
     upload = byteToMbits(currentTest["upload"]["bandwidth"])
 
     cPrint(f"P{ping}, D{download}, U{upload} - {currentTest['result']['id']}")
 
+    # Bytes moved, estimated from bandwidth when the tester does not say
+    transferred = sum(
+        currentTest[direction].get(
+            "bytes", currentTest[direction]["bandwidth"] * duration
+        )
+        for direction in ("download", "upload")
+    )
+    tester = currentTest["result"]["id"]
     currentTest = SpeedTest(SCANID, ping, download, upload)
 
     date = time.strftime("%Y%m%d")
-    todaysTests = processCurrentTest(currentTest, date)
-    todaysSummary = createSummary(todaysTests, date)
-    if args.recalc:
-        recalcAllSummaries(time.strftime("%Y"))
+    if short:
+        processShortTest(currentTest, date, tester, duration)
     else:
-        saveTodaysSummary(todaysSummary)
+        processCurrentTest(currentTest, date)
+    if recalc:
+        recalcAllSummaries(*recalc)
+    renderReport(date)
+
+    # Static bounds are a hard floor, the baseline of this hour of the week
+    # adds drops from the usual once warmed up; short tests are not comparable
+    deviations = [
+        f"{measure} {value} under {CONF['speedTest'][bound]} minimum"
+        for measure, value, bound in (
+            ("Download", download, "minDownload"),
+            ("Upload", upload, "minUpload"),
+        )
+        if float(value) < CONF["speedTest"][bound]
+    ]
+    if not short:
+        deviations += checkBaseline(currentTest) or []
+    if schedule:
+        planNextTest(schedule, transferred, bool(deviations))
+
+    # Probes of the past hour tell ISP trouble apart from a bad remote server
+    probes = summarizeProbes(datetime.now() - timedelta(hours=1))
+    cPrint(probes, "BLUE") if probes else None
 
-    if (
-        float(download) < CONF["speedTest"]["minDownload"]
-        or float(upload) < CONF["speedTest"]["minUpload"]
-        or args.test
-    ):
+    if deviations or args.test:
         cPrint("Speeds outside of boundaries, sending notification...", "RED")
         subject = f"ISP Speed Alert"
         message = f"ISP: P{ping}, D{download}, U{upload}"
+        message += "".join(f"\n{deviation}" for deviation in deviations)
+        message += f"\n{probes}" if probes else ""
 
         sendNotification(subject, message, ttl=600)
     else:
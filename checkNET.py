@@ -8,42 +8,125 @@
 # By default, all devices will show as untrusted.
 # USAGE via CRON: (Runs every 10 minutes, must be ROOT user)
 #   */10 * * * * cd /path/to/folder && ./checkNET.py 2>&1 | ./tailog.py
+# Ranges, chunk size and nmap workers are set in config.json under "network".
+# Sweeps are scheduled per chunk, volatile chunks more often than quiet ones,
+# within a per-run probe budget; leftover budget probes volatile devices.
+# USAGE as a watcher: (Alerts within seconds, run as a systemd service)
+#   ExecStart=/path/to/folder/checkNET.py --watch --cron, WorkingDirectory set
+#   to the folder; output goes to the journal, not through tailog.py, which
+#   only curtails and indexes a log once its input ends.
 # USAGE via CLI:
-#   cd /path/to/folder && ./checkNET.py (-dn)
+#   cd /path/to/folder && ./checkNET.py (-denpuw)
 #   Flags:  -d: prints debug messages and doesn't send notification
-#           -n: to use a cached nmap scan, created on first run
+#           -e: compacts the device journal and exports data/devices.csv
+#           --presence MAC|all: prints presence windows and uptime (--days 7)
+#           -n: to reuse cached scan results of any age, created on first run
+#           --max-age M: reuses cached scan results younger than M minutes
+#           -p: only reads the neighbour table and DHCP leases, no nmap sweep
+#           -w: watches the neighbour table and DHCP leases for new devices
+#           --bench N: times each stage on N generated hosts, nmap excluded
+#           -u: downloads the IEEE OUI registries into the vendor table
 ##############################################################################80
 # Copyright (c) Liam Siira (www.siira.io), distributed as-is and without
 # warranty under the MIT License. See [root]/docs/LICENSE.md for more.
 ##############################################################################80
 
 import os
+import re
 import sys
+import json
+import time
+import fcntl
+import queue
+import select
+import ctypes
+import mmap
+import shutil
+import calendar
+import resource
+import tempfile
 import subprocess
+import ipaddress
 import xml.etree.ElementTree as ET
 import csv
 import requests
-from collections import namedtuple
-from datetime import datetime, timedelta
+import utils
+from contextlib import contextmanager
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from utils import (
+    appendSynced,
     checkSudo,
     cPrint,
     formatIP,
     getBaseParser,
+    lineBuffered,
     pingHealth,
     sendNotification,
     SCANID,
+    CONF,
 )
 
 ##############################################################################80
 # Global variables
 ##############################################################################80
 parser = getBaseParser("Scans network range for unregistered devices.")
+parser.add_argument(
+    "-e",
+    "--export",
+    action="store_true",
+    help="Compacts the device journal and exports the CSV.",
+)
 parser.add_argument(
     "-n",
     "--noscan",
     action="store_true",
-    help="Uses cached scanlog, requires initial run.",
+    help="Reuses cached scan results of any age, requires initial run.",
+)
+parser.add_argument(
+    "--max-age",
+    type=int,
+    default=CONF.get("network", {}).get("maxAge", 0),
+    metavar="MINUTES",
+    help="Reuses cached scan results younger than this, instead of nmap.",
+)
+parser.add_argument(
+    "-p",
+    "--passive",
+    action="store_true",
+    help="Only reads the neighbour table and DHCP leases, skips nmap sweeps.",
+)
+parser.add_argument(
+    "-w",
+    "--watch",
+    action="store_true",
+    help="Watches the neighbour table and DHCP leases for new devices.",
+)
+parser.add_argument(
+    "--presence",
+    metavar="MAC",
+    help="Prints presence windows and uptime of a device, or uptime of all.",
+)
+parser.add_argument(
+    "--days",
+    type=int,
+    default=7,
+    help="Days of history covered by --presence, defaults to 7.",
+)
+parser.add_argument(
+    "--bench",
+    type=int,
+    nargs="?",
+    const=50000,
+    metavar="HOSTS",
+    help="Times each stage on generated hosts, defaults to 50000.",
+)
+parser.add_argument(
+    "-u",
+    "--updateoui",
+    action="store_true",
+    help="Downloads the IEEE OUI registries into the vendor table.",
 )
 args = parser.parse_args()
 
@@ -51,84 +134,531 @@ args = parser.parse_args()
 ##############################################################################80
 # Configurations
 ##############################################################################80
-scanpath = "data/scanlog.xml"
+scanpath = "data/scans"
 datapath = "data/devices.csv"
-netRange = "192.168.1.1/24"
+storepath = "data/devices.json"
+journalpath = "data/devices.log"
+rangepath = "data/ranges.csv"
+volatilepath = "data/volatile.json"
+presencepath = "data/presence"
+sweeppath = "data/presence/sweeps"
+ouipath = "data/oui.tsv"
+ouiRegistries = [
+    "https://standards-oui.ieee.org/oui/oui.csv",  # MA-L, 24 bit prefixes
+    "https://standards-oui.ieee.org/oui28/mam.csv",  # MA-M, 28 bit prefixes
+    "https://standards-oui.ieee.org/oui36/oui36.csv",  # MA-S, 36 bit prefixes
+]
+ouiTable = None
+netRanges = CONF.get("network", {}).get("ranges", ["192.168.1.1/24"])
+chunkPrefix = CONF.get("network", {}).get("chunkPrefix", 24)
+scanWorkers = CONF.get("network", {}).get("workers", 4)
+sweepInterval = CONF.get("network", {}).get("sweepInterval", 10)  # minutes
+maxSweepInterval = CONF.get("network", {}).get("maxSweepInterval", 120)  # minutes
+probeBudget = CONF.get("network", {}).get("probeBudget", 4096)  # addresses per run
+volatileFlips = CONF.get("network", {}).get("volatileFlips", 6)  # per day
+presenceInterval = CONF.get("network", {}).get("presenceInterval", 10)  # minutes
+maxAge = float("inf") if args.noscan else args.max_age  # minutes
+leaseFiles = CONF.get("network", {}).get(
+    "leaseFiles", ["/var/lib/misc/dnsmasq.leases", "/var/lib/dhcp/dhcpd.leases"]
+)
+benchTarget = 4.0  # seconds for the slowest run, nmap excluded, compaction included
+benchRuns = 3  # consecutive runs per size, the last one compacting
 thirtyDaysAgo = datetime.now() - timedelta(days=30)
 oneHourAgo = datetime.now() - timedelta(hours=1)
+IN_CLOSE_WRITE, IN_MOVED_TO = 0x08, 0x80
+NEIGHBOUR = re.compile(
+    rb"^([\d.]+) dev \S+ lladdr ([0-9a-f:]{17}).*\b(REACHABLE|DELAY|PROBE)\b"
+)
 
 
 ##############################################################################80
-# Launch NMAP and scan the network mask provided
+# Launch NMAP and scan the network mask provided, yielding hosts as they are
+# written by nmap; the XML is copied to scanlog for later --noscan runs
 ##############################################################################80
 def getNmapScan(netRange, scanlog):
     cPrint("Running NMAP scan on network range...", "BLUE") if args.debug else None
 
-    # Run nmap scan of netRange, save xml to scanlog file
-    if not args.noscan:
-        try:
-            subprocess.run(
-                ["sudo", "nmap", "-v", "-sn", netRange, "-oX", scanlog],
-                check=True,
-                capture_output=True,
-            )
+    if args.noscan:
+        with open(scanlog, "rb") as stream:
+            yield from streamHosts(stream)
+        return
+
+    # Run nmap scan of netRange, streaming xml through stdout; stderr goes to a
+    # file, as a full pipe of warnings would block nmap while stdout is read
+    errors = tempfile.TemporaryFile()
+    nmap = subprocess.Popen(
+        ["sudo", "nmap", "-v", "-sn", netRange, "-oX", "-"],
+        stdout=subprocess.PIPE,
+        stderr=errors,
+    )
+    with nmap, errors, open(scanlog, "wb") as copy:
+        yield from streamHosts(nmap.stdout, copy)
+        nmap.wait()
+        errors.seek(0)
+        error = errors.read().decode("utf-8").strip()
 
-        except subprocess.CalledProcessError as e:
-            cPrint(f"Error running nmap: {e}", "RED")
-            sys.exit(127)
+    if nmap.returncode != 0:
+        cPrint(f"Error running nmap: {error}", "RED")
+        sys.exit(127)
 
-    # Open scanlog file and find root
+
+##############################################################################80
+# Incrementally parse nmap XML, clearing each host once it has been yielded;
+# only end events are read, leaving an empty element per host under the root
+##############################################################################80
+def streamHosts(stream, copy=None):
+    parser = ET.XMLPullParser(events=("end",))
     try:
-        root = ET.parse(scanlog).getroot()
+        for chunk in iter(lambda: stream.read1(65536), b""):
+            if copy:
+                copy.write(chunk)
+            parser.feed(chunk)
+
+            for event, elem in parser.read_events():
+                if elem.tag != "host":
+                    continue
+
+                host = parseHost(elem)
+                elem.clear()
+                if host:
+                    yield host
+        parser.close()
     except ET.ParseError as e:
         cPrint(f"Error parsing scanlog: {e}", "RED")
         sys.exit(1)
 
-    hosts = root.findall("./host")
-    if not hosts:
-        return {}
 
-    scan = []
-    for child in hosts:
-        state = mac = ip = vendor = ""
-        for attrib in child:
-            if attrib.tag == "status":
-                state = attrib.attrib["state"]
-            if attrib.tag == "address":
-                if attrib.attrib["addrtype"] == "mac":
-                    mac = attrib.attrib["addr"]
-                if attrib.attrib["addrtype"] == "ipv4":
-                    ip = formatIP(attrib.attrib["addr"])
-                if "vendor" in attrib.attrib:
-                    vendor = attrib.attrib["vendor"]
-                else:
-                    vendor = "unknown"
-        if state == "down":
+##############################################################################80
+# Extract a single host record, skipping hosts that are down or without MAC
+##############################################################################80
+def parseHost(child):
+    state = mac = ip = vendor = ""
+    for attrib in child:
+        values = attrib.attrib
+        if attrib.tag == "status":
+            state = values["state"]
+        elif attrib.tag == "address":
+            if values["addrtype"] == "mac":
+                mac = values["addr"]
+            elif values["addrtype"] == "ipv4":
+                ip = values["addr"]
+            vendor = values.get("vendor", "unknown")
+    if state == "down":
+        return None
+
+    if mac == "":
+        return None
+
+    ip = formatIP(ip)
+
+    if args.debug:
+        cPrint(f"{mac}\t{vendor}\t{ip}")
+
+    return {"mac": mac, "vendor": vendor, "ip": ip}
+
+
+##############################################################################80
+# Split configured ranges into chunks no larger than chunkPrefix
+##############################################################################80
+def splitRanges(ranges):
+    chunks = []
+    for netRange in ranges:
+        network = ipaddress.ip_network(netRange, strict=False)
+        if network.prefixlen < chunkPrefix:
+            chunks.extend(network.subnets(new_prefix=chunkPrefix))
+        else:
+            chunks.append(network)
+    return chunks
+
+
+##############################################################################80
+# Scan all chunks with a bounded pool of nmap workers, merging their hosts
+# into one stream; each worker ends its stream by queueing None
+##############################################################################80
+def scanRanges(ranges, scanpath):
+    os.makedirs(scanpath, exist_ok=True)
+    chunks = splitRanges(ranges)
+    hosts = queue.Queue()
+
+    def scanChunk(chunk):
+        start, found = time.monotonic(), []
+        basename = f"{scanpath}/{chunk.network_address}_{chunk.prefixlen}"
+        cache = None
+        try:
+            cache = loadScanCache(f"{basename}.json")
+            if cache and scanAge(cache) <= maxAge:
+                for host in cache["hosts"]:
+                    hosts.put(dict(host, heard=cache["scanned"]))
+                return None, 0
+            for host in getNmapScan(str(chunk), f"{basename}.xml"):
+                hosts.put(host)
+                found.append(host)
+        finally:
+            hosts.put(None)
+        if args.noscan:
+            return None, 0
+
+        # Hosts that came or went since the previous sweep of this chunk
+        macs = {host["mac"] for host in found}
+        previous = {host["mac"] for host in cache["hosts"]} if cache else macs
+        saveScanCache(f"{basename}.json", found)
+
+        seconds = f"{time.monotonic() - start:.2f}"
+        return Subnet(str(chunk), SCANID, seconds, len(macs)), len(previous ^ macs)
+
+    with ThreadPoolExecutor(max_workers=scanWorkers) as pool:
+        futures = [pool.submit(scanChunk, chunk) for chunk in chunks]
+        finished = 0
+        while finished < len(futures):
+            host = hosts.get()
+            if host is None:
+                finished += 1
+                continue
+            yield host
+
+    # Volatility is a moving average of changes per sweep, single host
+    # probes are left out as they are not part of the configured chunks,
+    # and chunks served from the cache keep their previous sweep
+    subnets = loadRanges(rangepath)
+    known = set(map(str, splitRanges(netRanges)))
+    swept = []
+    for future in futures:
+        subnet, changes = future.result()
+        if subnet is None:
+            continue
+        swept.append(subnet.Range)
+        if args.debug:
+            cPrint(f"{subnet.Range}: {subnet.Hosts} hosts in {subnet.Seconds}s")
+        if subnet.Range not in known:
             continue
+        if subnet.Range in subnets:
+            volatility = float(subnets[subnet.Range].Volatility)
+            changes = 0.3 * changes + 0.7 * volatility
+        subnets[subnet.Range] = subnet._replace(Volatility=f"{changes:.2f}")
+    saveRanges(rangepath, subnets)
+    recordPresence(swept, datetime.strptime(SCANID, "%Y%m%d%H%M"), sweeppath)
+
+
+##############################################################################80
+# Parsed sweep results are cached per chunk with the SCANID of their sweep, and
+# served instead of running nmap again while younger than maxAge. A cache that
+# cannot be read is a miss, so the chunk is swept again.
+##############################################################################80
+def loadScanCache(filepath):
+    try:
+        with open(filepath, mode="r") as reader:
+            cache = json.load(reader)
+        scanAge(cache)
+        if all(isinstance(host, dict) and "mac" in host for host in cache["hosts"]):
+            return cache
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def saveScanCache(filepath, hosts):
+    with open(f"{filepath}.temp", "w") as writer:
+        json.dump({"scanned": SCANID, "hosts": hosts}, writer, separators=(",", ":"))
+    os.replace(f"{filepath}.temp", filepath)
+
+
+def scanAge(cache):
+    scanned = datetime.strptime(cache["scanned"], "%Y%m%d%H%M")
+    return (datetime.now() - scanned) / timedelta(minutes=1)
 
-        if mac == "":
+
+Subnet = namedtuple(
+    "Subnet", ("Range LastScan Seconds Hosts Volatility"), defaults=["0.00"]
+)
+
+
+##############################################################################80
+# Function to load per-subnet scan timings from CSV
+##############################################################################80
+def loadRanges(filepath):
+    subnets = {}
+    if not os.path.exists(filepath):
+        return subnets
+
+    with open(filepath, mode="r") as reader:
+        # Create a DictReader, and then strip whitespace from the field names
+        readCSV = csv.DictReader(
+            (line.replace("\0", "") for line in reader), delimiter="|"
+        )
+        readCSV.fieldnames = [name.strip() for name in readCSV.fieldnames]
+
+        for row in readCSV:
+            cleaned_row = {k: v.strip() for k, v in row.items()}
+            subnets[cleaned_row["Range"]] = Subnet(**cleaned_row)
+    return subnets
+
+
+##############################################################################80
+# Function to save per-subnet scan timings to CSV
+##############################################################################80
+def saveRanges(filepath, subnets):
+    with open(filepath, "w") as writer:
+        writeCSV = csv.writer(writer)
+        header = "{:^18}|{:^12}|{:^8}|{:^6}|{:^10}".format(*Subnet._fields)
+        writeCSV.writerow(header.split("|", 0))
+
+        for subnet in subnets.values():
+            row = "{:<18}|{:>12}|{:>8}|{:>6}|{:>10}".format(*subnet).split("|", 0)
+            writeCSV.writerow(row)
+    return True
+
+
+##############################################################################80
+# Pick this run's sweep targets: chunks are due once their interval, shrinking
+# from maxSweepInterval towards sweepInterval as volatility grows, has passed,
+# most overdue first while within probeBudget; leftover budget goes to single
+# probes of volatile devices outside the chosen chunks
+##############################################################################80
+def scheduleScan(ranges, database):
+    if args.noscan:
+        return list(map(str, splitRanges(ranges)))
+    subnets = loadRanges(rangepath)
+    now = datetime.now()
+
+    due = []
+    for chunk in splitRanges(ranges):
+        subnet = subnets.get(str(chunk))
+        if not subnet:
+            due.append((float("inf"), chunk))
             continue
+        volatility = float(subnet.Volatility)
+        interval = max(sweepInterval, maxSweepInterval / (1 + volatility))
+        elapsed = now - datetime.strptime(subnet.LastScan, "%Y%m%d%H%M")
+        overdue = elapsed / timedelta(minutes=interval)
+        if overdue >= 1:
+            due.append((overdue, chunk))
 
-        if args.debug:
-            cPrint(f"{mac}\t{vendor}\t{ip}")
+    targets, budget = [], probeBudget
+    for overdue, chunk in sorted(due, key=lambda item: -item[0]):
+        if targets and chunk.num_addresses > budget:
+            continue
+        targets.append(chunk)
+        budget -= chunk.num_addresses
+
+    for ip in volatileHosts(database):
+        if budget <= 0:
+            break
+        address = ipaddress.ip_address(ip)
+        if not any(address in chunk for chunk in targets):
+            targets.append(ipaddress.ip_network(address))
+            budget -= 1
+
+    if args.debug:
+        cPrint(f"Scheduled {len(targets)} targets, {budget} probes unused.")
+    return list(map(str, targets))
+
+
+##############################################################################80
+# Devices whose presence flipped at least volatileFlips times over the past
+# day, most volatile first, as unpadded IP addresses, from the cached flips
+##############################################################################80
+def volatileHosts(database):
+    cutoff = (datetime.now() - timedelta(days=1)).strftime("%Y%m%d%H%M")
+    flips = {
+        mac: sum(flip > cutoff for flip in entry[1:])
+        for mac, entry in loadVolatility().items()
+        if mac in database
+    }
+    volatile = [mac for mac, count in flips.items() if count >= volatileFlips]
+    volatile.sort(key=lambda mac: -flips[mac])
+    return [
+        ".".join(str(int(octet)) for octet in database[mac].IP.split("."))
+        for mac in volatile
+    ]
+
+
+def loadVolatility():
+    try:
+        with open(volatilepath, mode="r") as reader:
+            return json.load(reader)
+    except (OSError, ValueError):
+        return {}
+
+
+##############################################################################80
+# Running flips of devices observed this run, heard or within a swept target,
+# so the cost follows the sweep rather than the store. Each device keeps its
+# last observed state and the SCANIDs of its flips over the past day, [state,
+# *flips]; unswept gaps are no observation, so they are not absences.
+##############################################################################80
+def refreshVolatility(database, heard, targets, now):
+    observed = dict.fromkeys(heard, 1)
+    for target in targets:
+        for address in ipaddress.ip_network(target):
+            mac = database.ips.get(formatIP(str(address)))
+            observed.setdefault(mac, 0) if mac else None
+
+    volatility = loadVolatility()
+    cutoff = (now - timedelta(days=1)).strftime("%Y%m%d%H%M")
+    for mac, state in observed.items():
+        last, *flips = volatility.get(mac, [state])
+        flips = [flip for flip in flips if flip > cutoff]
+        if state != last:
+            flips.append(now.strftime("%Y%m%d%H%M"))
+        volatility[mac] = [state, *flips]
+
+    with open(f"{volatilepath}.temp", "w") as writer:
+        json.dump(volatility, writer, separators=(",", ":"))
+    os.replace(f"{volatilepath}.temp", volatilepath)
+
+
+##############################################################################80
+# Read live entries from the kernel neighbour table as {mac: ip}, falling
+# back to /proc/net/arp where iproute2 is unavailable
+##############################################################################80
+def readNeighbours():
+    neighbours = {}
+    try:
+        output = subprocess.check_output(["ip", "-j", "-4", "neigh"], text=True)
+        for entry in json.loads(output):
+            states = entry.get("state", [])
+            if "lladdr" in entry and {"REACHABLE", "DELAY", "PROBE"} & set(states):
+                neighbours[entry["lladdr"].upper()] = entry["dst"]
+        return neighbours
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        pass
+
+    with open("/proc/net/arp", mode="r") as reader:
+        next(reader)  # Skip header
+        for line in reader:
+            ip, _, flags, mac = line.split()[:4]
+            if int(flags, 16) & 0x2 and mac != "00:00:00:00:00:00":
+                neighbours[mac.upper()] = ip
+    return neighbours
+
+
+##############################################################################80
+# Read unexpired leases from dnsmasq and ISC dhcpd lease files as {mac: ip}
+##############################################################################80
+def readLeases(filepaths):
+    leases = {}
+    now = time.time()
+    for filepath in filepaths:
+        if not os.path.exists(filepath):
+            continue
+
+        with open(filepath, mode="r") as reader:
+            content = reader.read()
+
+        # ISC dhcpd: lease blocks, later blocks supersede earlier ones
+        for ip, block in re.findall(r"lease ([\d.]+) \{(.*?)\}", content, re.S):
+            mac = re.search(r"hardware ethernet ([0-9a-fA-F:]+);", block)
+            state = re.search(r"^\s*binding state (\w+);", block, re.M)
+            ends = re.search(r"ends \d ([\d/]+ [\d:]+);", block)
+            if not mac or (state and state.group(1) != "active"):
+                continue
+            if ends:
+                expiry = datetime.strptime(ends.group(1), "%Y/%m/%d %H:%M:%S")
+                if expiry.replace(tzinfo=timezone.utc).timestamp() < now:
+                    continue
+            leases[mac.group(1).upper()] = ip
+
+        # dnsmasq: "expiry mac ip hostname clientid", expiry 0 never expires
+        for expiry, mac, ip in re.findall(
+            r"^(\d+) ([0-9a-fA-F:]{17}) ([\d.]+) ", content, re.M
+        ):
+            if int(expiry) == 0 or int(expiry) > now:
+                leases[mac.upper()] = ip
+    return leases
 
-        scan.append({"mac": mac, "vendor": vendor, "ip": ip})
 
-    return scan
+##############################################################################80
+# Passive discovery between sweeps: the neighbour table refreshes LastHeard,
+# while leases, which outlive a device's presence, only report unknown MACs
+##############################################################################80
+def getPassiveScan(ranges, database):
+    cPrint("Reading neighbour table and leases...", "BLUE") if args.debug else None
+    known = database or {}
+
+    found = readNeighbours()
+    for mac, ip in readLeases(leaseFiles).items():
+        if mac not in known and mac not in found:
+            found[mac] = ip
+    return filterHosts(found, ranges)
+
+
+##############################################################################80
+# Convert {mac: ip} into scan records, dropping addresses outside the ranges
+##############################################################################80
+def filterHosts(found, ranges):
+    networks = [ipaddress.ip_network(r, strict=False) for r in ranges]
+    for mac, ip in found.items():
+        if not any(ipaddress.ip_address(ip) in network for network in networks):
+            continue
+        if args.debug:
+            cPrint(f"{mac}\tpassive\t{formatIP(ip)}")
+        yield {"mac": mac, "vendor": "unknown", "ip": formatIP(ip)}
 
 
 Device = namedtuple("Device", ("Status Name MAC IP FirstHeard LastHeard Vendor"))
 
 
 ##############################################################################80
-# Function to load device databas from CSV
+# Devices keyed by MAC, indexed by IP and Status, remembering which MACs were
+# changed or added since the last save so only those rows are persisted, and
+# the state of the files on disk when last loaded or saved
 ##############################################################################80
-def loadDatabase(filepath):
-    cPrint("Reading device database...", "BLUE") if args.debug else None
-    database = {}
-    if not os.path.exists(filepath):
-        return False
+class DeviceStore(dict):
+    def __init__(self):
+        super().__init__()
+        self.ips = {}
+        self.statuses = defaultdict(set)
+        self.changed = set()
+        self.added = set()
+        self.heard = set()
+        self.imported = False
+        self.stamp = None
+
+    def __setitem__(self, mac, device):
+        old = self.get(mac)
+        if old == device:
+            return
+        if old is None:
+            self.added.add(mac)
+        if old is None or old.LastHeard != device.LastHeard:
+            self.heard.add(mac)
+        # Sightings alone go to the heard column instead of the journal
+        if old and old._replace(LastHeard=device.LastHeard) == device:
+            super().__setitem__(mac, device)
+            return
+        if old:
+            self.statuses[old.Status].discard(mac)
+            if self.ips.get(old.IP) == mac:
+                del self.ips[old.IP]
+        super().__setitem__(mac, device)
+        self.statuses[device.Status].add(mac)
+        self.ips[device.IP] = mac
+        self.changed.add(mac)
+
+    def __delitem__(self, mac):
+        device = self[mac]
+        super().__delitem__(mac)
+        self.statuses[device.Status].discard(mac)
+        if self.ips.get(device.IP) == mac:
+            del self.ips[device.IP]
+        for marked in (self.changed, self.added, self.heard):
+            marked.discard(mac)
 
+    def fill(self, devices):
+        # Bulk load into an empty store, indexing once instead of per row
+        super().update((device.MAC, device) for device in devices)
+        self.ips = {device.IP: device.MAC for device in self.values()}
+        for device in self.values():
+            self.statuses[device.Status].add(device.MAC)
+
+    def withStatus(self, *statuses):
+        return [self[mac] for status in statuses for mac in self.statuses[status]]
+
+
+##############################################################################80
+# Function to read device rows from the hand-editable CSV export
+##############################################################################80
+def readDeviceCSV(filepath):
     with open(filepath, mode="r") as reader:
         # Create a DictReader, and then strip whitespace from the field names
         readCSV = csv.DictReader(
@@ -138,56 +668,465 @@ def loadDatabase(filepath):
 
         for row in readCSV:
             cleaned_row = {k: v.strip() for k, v in row.items()}
-            database[cleaned_row["MAC"]] = Device(**cleaned_row)
+            yield Device(**cleaned_row)
+
+
+##############################################################################80
+# Exclusive lock on the device store while it is read or written, as cron runs
+# and the watcher share the journal, snapshot, CSV and presence files
+##############################################################################80
+@contextmanager
+def databaseLock():
+    with open(f"{storepath}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def storeStamp(filepath):
+    stamps = []
+    for path in (storepath, journalpath, filepath, f"{presencepath}/heard.bin"):
+        stat = os.stat(path) if os.path.exists(path) else None
+        stamps.append((stat.st_mtime_ns, stat.st_size) if stat else None)
+    return stamps
+
+
+##############################################################################80
+# Function to load device database from the snapshot and replay the journal,
+# skipping a row torn by a crash, then the heard column on top. Edits made to
+# the CSV export since it was written are merged back in; deleting a row
+# deletes the device.
+##############################################################################80
+def loadDatabase(filepath):
+    cPrint("Reading device database...", "BLUE") if args.debug else None
+    with databaseLock():
+        database = readDatabase(filepath)
+        database.stamp = storeStamp(filepath)
+    return database
+
+
+def readDatabase(filepath):
+    database = DeviceStore()
+    exported, exportedMacs = 0, set()
+    heard = readHeard()
+
+    def withHeard(row):
+        # The heard column holds sightings newer than the stored rows
+        row[5] = max(row[5], heard.get(row[2], ""))
+        return Device._make(row)
+
+    if os.path.exists(storepath):
+        with open(storepath, mode="r") as reader:
+            snapshot = json.load(reader)
+        exported = snapshot["exported"]
+        database.fill(map(withHeard, snapshot["devices"]))
+        exportedMacs = set(database)
+
+    if os.path.exists(journalpath):
+        with open(journalpath, mode="r") as reader:
+            for line in reader:
+                try:
+                    row = json.loads(line) if line.endswith("\n") else None
+                except ValueError:
+                    row = None
+                if row:
+                    database[row[2]] = withHeard(row)
+    database.changed.clear()
+    database.added.clear()
+    database.heard.clear()
+
+    # Status and Name are the hand-edited columns, new rows are taken whole
+    if os.path.exists(filepath) and os.path.getmtime(filepath) > exported:
+        database.imported = True
+        listed = set()
+        for device in readDeviceCSV(filepath):
+            listed.add(device.MAC)
+            current = database.get(device.MAC)
+            if current:
+                device = current._replace(Status=device.Status, Name=device.Name)
+            database[device.MAC] = device
+
+        # Devices added since the export are not in it yet, only exported ones
+        for mac in exportedMacs - listed:
+            if mac in database:
+                del database[mac]
     return database
 
 
 ##############################################################################80
-# Function to save device database to CSV
+# Function to save changed devices to the journal, compacting it into the
+# snapshot and CSV export once it outgrows the snapshot, and sightings to the
+# heard column, which never grows the journal. Returns the store,
+# which is reloaded and merged if another process wrote it since it was read.
 ##############################################################################80
 def saveDatabase(filepath, data):
     cPrint("Saving device database...", "BLUE") if args.debug else None
-    header = list(data[next(iter(data))]._fields) if data else []
+    with databaseLock():
+        if storeStamp(filepath) != data.stamp:
+            data = mergeDatabase(filepath, data)
 
-    with open(filepath, "w") as writer:
+        # Allowed devices unheard for more than 30 days become inactive
+        cutoff = thirtyDaysAgo.strftime("%Y%m%d%H%M")
+        for device in data.withStatus("allowed"):
+            if device.LastHeard < cutoff:
+                data[device.MAC] = device._replace(Status="inactive")
+
+        if data.changed:
+            rows = "".join(json.dumps(data[mac]) + "\n" for mac in data.changed)
+            appendSynced(journalpath, rows)
+            data.changed.clear()
+            data.added.clear()
+        if data.heard:
+            writeHeard(data)
+            data.heard.clear()
+
+        snapshotSize = os.path.getsize(storepath) if os.path.exists(storepath) else 0
+        journalSize = os.path.getsize(journalpath) if os.path.exists(journalpath) else 0
+        if args.export or data.imported or journalSize > max(snapshotSize, 65536):
+            compactDatabase(filepath, data)
+        data.stamp = storeStamp(filepath)
+    return data
+
+
+##############################################################################80
+# Apply this process's changes onto the store as now on disk: Status and Name
+# are taken from disk, where hand edits arrive, heard fields from the newer
+# sighting. Devices gone from disk were deleted, unless added here.
+##############################################################################80
+def mergeDatabase(filepath, data):
+    cPrint("Device store changed on disk, merging...", "BLUE") if args.debug else None
+    fresh = readDatabase(filepath)
+    for mac in data.changed:
+        mine, theirs = data[mac], fresh.get(mac)
+        if theirs is None:
+            if mac in data.added:
+                fresh[mac] = mine
+            continue
+
+        newer = mine if mine.LastHeard > theirs.LastHeard else theirs
+        status = theirs.Status
+        if status == "inactive" and newer is mine:
+            status = "allowed"
+        firstHeard = min(mine.FirstHeard, theirs.FirstHeard)
+        fresh[mac] = newer._replace(
+            Status=status, Name=theirs.Name, FirstHeard=firstHeard
+        )
+
+    for mac in data.heard - data.changed:
+        mine, theirs = data[mac], fresh.get(mac)
+        if theirs and mine.LastHeard > theirs.LastHeard:
+            status = "allowed" if theirs.Status == "inactive" else theirs.Status
+            fresh[mac] = theirs._replace(Status=status, LastHeard=mine.LastHeard)
+    return fresh
+
+
+##############################################################################80
+# LastHeard of every MAC as a fixed-width column, data/presence/heard.bin, one
+# little-endian 64-bit YYYYMMDDHHMM per row in devices.txt order
+##############################################################################80
+def readHeard():
+    if not os.path.exists(f"{presencepath}/heard.bin"):
+        return {}
+    with open(f"{presencepath}/heard.bin", mode="rb") as reader:
+        column = reader.read()
+    return {
+        mac: str(int.from_bytes(column[row * 8 : row * 8 + 8], "little"))
+        for mac, row in presenceRows().items()
+        if row * 8 < len(column)
+    }
+
+
+def writeHeard(data):
+    os.makedirs(presencepath, exist_ok=True)
+    rows = presenceRows(data.heard)
+    heardpath = f"{presencepath}/heard.bin"
+    open(heardpath, "ab").close()
+    with open(heardpath, "r+b") as writer:
+        if os.path.getsize(heardpath) < len(rows) * 8:
+            writer.truncate(len(rows) * 8)
+        with mmap.mmap(writer.fileno(), 0) as mm:
+            for mac in data.heard:
+                offset = rows[mac] * 8
+                lastHeard = int(data[mac].LastHeard)
+                if lastHeard > int.from_bytes(mm[offset : offset + 8], "little"):
+                    mm[offset : offset + 8] = lastHeard.to_bytes(8, "little")
+
+
+##############################################################################80
+# Function to export the CSV, write a fresh snapshot and empty the journal
+##############################################################################80
+def compactDatabase(filepath, data):
+    cPrint("Compacting device database...", "BLUE") if args.debug else None
+
+    with open(f"{filepath}.temp", "w") as writer:
         writeCSV = csv.writer(writer)
         header = "{:^10}|{:^30}|{:^17}|{:^15}|{:^12}|{:^12}|{:^30}".format(
-            *header
+            *Device._fields
         ).split("|", 0)
         writeCSV.writerow(header)
 
-        for mac, details in data.items():
-            # Parse the LastHeard date and update the status if it"s more than 30 days ago
-            lastHeard = datetime.strptime(
-                details.LastHeard, "%Y%m%d%H%M"
-            )  # Adjust the format if different
-
-            if details.Status == "allowed" and lastHeard < thirtyDaysAgo:
-                details = details._replace(Status="inactive")
-
+        for details in sorted(data.values(), key=lambda device: device.IP):
             details = "{:^10}|{:<30}|{:>17}|{:^15}|{:>12}|{:>12}|{:<30}".format(
                 *details
             ).split("|", 0)
             writeCSV.writerow(details)
-    return True
+    os.replace(f"{filepath}.temp", filepath)
+
+    snapshot = {"exported": os.path.getmtime(filepath), "devices": list(data.values())}
+    with open(f"{storepath}.temp", "w") as writer:
+        json.dump(snapshot, writer, separators=(",", ":"))
+    os.replace(f"{storepath}.temp", storepath)
+    open(journalpath, "w").close()
+    data.imported = False
 
 
 ##############################################################################80
-# Parse scan to determine new devices, update devices.csv
+# Presence timelines are monthly bitmaps, data/presence/YYYYMM.bin, holding one
+# fixed-width row per MAC (row order in devices.txt) and one bit per interval.
+# Sweeps are kept alike in data/presence/sweeps, one row per range swept.
+# Rows are appended for any of macs not listed yet, under the database lock.
 ##############################################################################80
-def searchVendor(mac):
-    cPrint("Searching MAC against vendor API...", "BLUE") if args.debug else None
-    url = f"https://api.macvendors.com/{mac}"
-    try:
-        response = requests.get(url)
-        if args.debug:
-            cPrint(response.text)
-        if response.status_code == 200:
-            return response.text  # The vendor name
+def presenceRows(macs=(), path=None):
+    path, rows = path or presencepath, {}
+    if os.path.exists(f"{path}/devices.txt"):
+        with open(f"{path}/devices.txt", mode="r") as reader:
+            for index, line in enumerate(reader):
+                rows[line.strip()] = index
+
+    newMacs = [mac for mac in macs if mac not in rows]
+    if newMacs:
+        with open(f"{path}/devices.txt", "a") as writer:
+            for mac in newMacs:
+                rows[mac] = len(rows)
+                writer.write(f"{mac}\n")
+    return rows
+
+
+def presenceLayout(month):
+    days = calendar.monthrange(month.year, month.month)[1]
+    slots = days * 1440 // presenceInterval
+    return slots, (slots + 7) // 8
+
+
+##############################################################################80
+# Set the presence bit of the current interval for every MAC heard, or range
+# swept when given the sweeps path
+##############################################################################80
+def recordPresence(macs, when, path=None):
+    os.makedirs(path or presencepath, exist_ok=True)
+    with databaseLock():
+        writePresence(macs, when, path or presencepath)
+
+
+def writePresence(macs, when, path):
+    # Nothing to set, and an empty bitmap of a fresh install cannot be mapped
+    if not macs:
+        return
+    rows = presenceRows(macs, path)
+
+    _, rowBytes = presenceLayout(when)
+    minutes = (when.day - 1) * 1440 + when.hour * 60 + when.minute
+    slot = minutes // presenceInterval
+
+    bitmap = f"{path}/{when:%Y%m}.bin"
+    open(bitmap, "ab").close()
+    with open(bitmap, "r+b") as writer:
+        if os.path.getsize(bitmap) < len(rows) * rowBytes:
+            writer.truncate(len(rows) * rowBytes)
+        with mmap.mmap(writer.fileno(), 0) as mm:
+            for mac in macs:
+                mm[rows[mac] * rowBytes + slot // 8] |= 1 << (slot % 8)
+
+
+##############################################################################80
+# Yield (monthStart, mask, rowBytes, bitmap) per month between start and end,
+# the mask selecting the intervals within range and the bitmap memory-mapped
+##############################################################################80
+def presenceMonths(start, end, path=None):
+    interval = timedelta(minutes=presenceInterval)
+    month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while month < end:
+        slots, rowBytes = presenceLayout(month)
+        first = max(0, -(-(start - month) // interval))
+        last = min(slots, -(-(end - month) // interval))
+        mask = ((1 << last) - 1) & ~((1 << first) - 1)
+
+        bitmap = f"{path or presencepath}/{month:%Y%m}.bin"
+        if os.path.exists(bitmap) and os.path.getsize(bitmap) > 0:
+            with open(bitmap, "rb") as reader:
+                with mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    yield month, mask, rowBytes, mm
         else:
-            return "unknown"
-    except requests.RequestException:
-        return "failed"
+            yield month, mask, rowBytes, b""
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+##############################################################################80
+# Yield (monthStart, bits) for one MAC, bit n being the month's nth interval
+##############################################################################80
+def presenceBits(mac, start, end):
+    row = presenceRows().get(mac)
+    if row is None:
+        return
+    for month, mask, rowBytes, mm in presenceMonths(start, end):
+        data = mm[row * rowBytes : (row + 1) * rowBytes]
+        yield month, int.from_bytes(data, "little") & mask
+
+
+##############################################################################80
+# Yield (mac, monthStart, mask, heard, observed) per device and month, observed
+# holding the intervals it was heard in or its range was swept in, reading
+# every monthly bitmap once for all devices
+##############################################################################80
+def presenceSamples(database, macs, start, end):
+    rows = presenceRows()
+    macs = [mac for mac in macs if mac in rows]
+    sweeps = sweptRanges(database, macs)
+    months = zip(presenceMonths(start, end), presenceMonths(start, end, sweeppath))
+    for (month, mask, rowBytes, mm), (_, _, _, swept) in months:
+        for mac in macs:
+            data = mm[rows[mac] * rowBytes : (rows[mac] + 1) * rowBytes]
+            heard = observed = int.from_bytes(data, "little") & mask
+            for row in sweeps.get(mac, ()):
+                data = swept[row * rowBytes : (row + 1) * rowBytes]
+                observed |= int.from_bytes(data, "little") & mask
+            yield mac, month, mask, heard, observed
+
+
+##############################################################################80
+# Rows of the swept ranges covering each device's IP, matched by masking the
+# address to the prefix length of every range swept
+##############################################################################80
+def sweptRanges(database, macs):
+    networks = {}
+    for name, row in presenceRows(path=sweeppath).items():
+        network = ipaddress.ip_network(name)
+        networks[int(network.network_address), network.prefixlen] = row
+    prefixes = {prefix for _, prefix in networks}
+
+    sweeps = {}
+    for mac in macs:
+        if mac not in database:
+            continue
+        address = int.from_bytes(bytes(map(int, database[mac].IP.split("."))), "big")
+        keys = ((address >> 32 - prefix << 32 - prefix, prefix) for prefix in prefixes)
+        sweeps[mac] = [networks[key] for key in keys if key in networks]
+    return sweeps
+
+
+##############################################################################80
+# Percentage of observed intervals between start and end in which each MAC was
+# heard, an interval being observed when heard or its range was swept
+##############################################################################80
+def presenceUptimes(database, macs, start, end):
+    heard, observed = dict.fromkeys(macs, 0), dict.fromkeys(macs, 0)
+    for mac, _, _, present, seen in presenceSamples(database, macs, start, end):
+        heard[mac] += present.bit_count()
+        observed[mac] += seen.bit_count()
+    return {
+        mac: round(100 * count / observed[mac], 2) if observed[mac] else 0
+        for mac, count in heard.items()
+    }
+
+
+##############################################################################80
+# Contiguous presence windows between start and end, as (from, to) pairs
+##############################################################################80
+def presenceWindows(mac, start, end):
+    windows = []
+    interval = timedelta(minutes=presenceInterval)
+    for month, bits in presenceBits(mac, start, end):
+        while bits:
+            low = (bits & -bits).bit_length() - 1
+            run = bits >> low
+            run = (~run & (run + 1)).bit_length() - 1  # Count of trailing ones
+            bits &= ~(((1 << run) - 1) << low)
+
+            begin, until = month + low * interval, month + (low + run) * interval
+            if windows and windows[-1][1] == begin:
+                windows[-1] = (windows[-1][0], until)
+            else:
+                windows.append((begin, until))
+    return windows
+
+
+##############################################################################80
+# Pretty print presence windows and uptime of a device
+##############################################################################80
+def showPresence(mac, days):
+    database = loadDatabase(datapath)
+    end = datetime.now()
+    start = end - timedelta(days=days)
+    if mac == "ALL":
+        uptimes = presenceUptimes(database, list(presenceRows()), start, end)
+        for mac, uptime in sorted(uptimes.items(), key=lambda item: -item[1]):
+            cPrint(f"{mac}\t{uptime}%")
+        return
+
+    for begin, until in presenceWindows(mac, start, end):
+        cPrint(f"{begin:%Y-%m-%d %H:%M} - {until:%Y-%m-%d %H:%M}")
+    uptime = presenceUptimes(database, [mac], start, end)[mac]
+    cPrint(f"{mac} uptime over {days} days: {uptime}%")
+
+
+##############################################################################80
+# Download the IEEE registries and compile them into a sorted prefix table
+##############################################################################80
+def updateVendorTable(filepath):
+    cPrint("Downloading IEEE OUI registries...", "BLUE") if args.debug else None
+    table = {}
+    for url in ouiRegistries:
+        try:
+            response = requests.get(url, timeout=60)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            cPrint(f"Error downloading {url}: {e}", "RED")
+            sys.exit(1)
+
+        readCSV = csv.DictReader(response.text.splitlines())
+        for row in readCSV:
+            prefix = row["Assignment"].strip().upper()
+            vendor = " ".join(row["Organization Name"].split())
+            if prefix and vendor:
+                table[prefix] = vendor
+
+    with open(f"{filepath}.temp", "w") as writer:
+        for prefix, vendor in sorted(table.items()):
+            writer.write(f"{prefix}\t{vendor}\n")
+    os.replace(f"{filepath}.temp", filepath)
+    cPrint(f"Vendor table updated with {len(table)} prefixes.", "BLUE")
+
+
+##############################################################################80
+# Load the prefix table, keyed by prefixes of 6, 7 or 9 hex digits
+##############################################################################80
+def loadVendorTable(filepath):
+    table = {}
+    if not os.path.exists(filepath):
+        cPrint("No vendor table found, run with --updateoui.", "YELLOW")
+        return table
+
+    with open(filepath, mode="r") as reader:
+        for line in reader:
+            prefix, vendor = line.rstrip("\n").split("\t", 1)
+            table[prefix] = vendor
+    return table
+
+
+##############################################################################80
+# Resolve the vendor of a MAC through the longest matching registry prefix
+##############################################################################80
+def searchVendor(mac):
+    global ouiTable
+    if ouiTable is None:
+        ouiTable = loadVendorTable(ouipath)
+
+    digits = mac.replace(":", "").replace("-", "").upper()
+    for length in (9, 7, 6):
+        vendor = ouiTable.get(digits[:length])
+        if vendor:
+            cPrint(f"{mac}\t{vendor}") if args.debug else None
+            return vendor
+    return "unknown"
 
 
 ##############################################################################80
@@ -195,41 +1134,43 @@ def searchVendor(mac):
 ##############################################################################80
 def processScan(scan, database):
     cPrint("Integrating scan into database...", "BLUE") if args.debug else None
-    for device in scan:
-        mac = device["mac"]
-        ip = device["ip"]
+    for host in scan:
+        mac = host["mac"]
+        ip = host["ip"]
+        heard = host.get("heard", SCANID)
 
-        device = database.get(
-            mac,
-            Device(
+        device = database.get(mac)
+        if device is None:
+            device = Device(
                 Status="intruder",
                 Name="unknown",
                 MAC=mac,
                 IP=ip,
-                FirstHeard=SCANID,
-                LastHeard=SCANID,
+                FirstHeard=heard,
+                LastHeard=heard,
                 Vendor="unknown",
-            ),
-        )
+            )
 
-        if device.Status == "inactive":
-            device = device._replace(Status="allowed")
-        # elif device.Status == "resurfaced":
-        #     device = device._replace(Status="active")
+        status = device.Status
+        if status == "inactive":
+            status = "allowed"
+        # elif status == "resurfaced":
+        #     status = "active"
 
         vendor = device.Vendor
-        if vendor == "unknown":
+        if vendor in ("unknown", "failed"):
             vendor = searchVendor(mac)
 
         vendor = vendor.replace(",", "").replace(".", "")
 
-        # Update data to the latest scan
-        device = device._replace(LastHeard=SCANID, IP=ip, Vendor=vendor)
+        # Update data to the latest scan, unless it is an older cached one
+        if heard < device.LastHeard:
+            ip, heard = device.IP, device.LastHeard
 
         # Update the database with the new or updated device
-        database[mac] = device
-
-    database = {k: v for k, v in sorted(database.items(), key=lambda item: item[1].IP)}
+        database[mac] = Device(
+            status, device.Name, mac, ip, device.FirstHeard, heard, vendor
+        )
 
     return database
 
@@ -242,11 +1183,16 @@ def processNewDevices(database):
 
     newDevices = 0
     message = "<b>New devices:</b>"
-    for mac, device in database.items():
-        lastHeard = datetime.strptime(
-            device.LastHeard, "%Y%m%d%H%M"
-        )  # Adjust the format if different
-        if device.Status not in ["allowed", "inactive"] and lastHeard > oneHourAgo:
+    recent = oneHourAgo.strftime("%Y%m%d%H%M")
+    suspects = [
+        device
+        for status in list(database.statuses)
+        if status not in ["allowed", "inactive"]
+        for device in database.withStatus(status)
+    ]
+    for device in sorted(suspects, key=lambda device: device.IP):
+        mac = device.MAC
+        if device.LastHeard > recent:
             cPrint(
                 f"Device detected: {device.MAC} by {device.Vendor} on {device.IP}",
                 "RED",
@@ -274,17 +1220,229 @@ def processNewDevices(database):
         cPrint("No new devices found.", "BLUE")
 
 
+##############################################################################80
+# Advance SCANID and the age cutoffs, which would otherwise stay fixed at the
+# start time of a long running watcher
+##############################################################################80
+def refreshClock(now=None):
+    global SCANID, thirtyDaysAgo, oneHourAgo
+    now = now or datetime.now()
+    SCANID = utils.SCANID = now.strftime("%Y%m%d%H%M")
+    thirtyDaysAgo = now - timedelta(days=30)
+    oneHourAgo = now - timedelta(hours=1)
+
+
+##############################################################################80
+# Subscribe to writes in the lease file directories through inotify
+##############################################################################80
+def watchLeases(filepaths):
+    libc = ctypes.CDLL(None, use_errno=True)
+    notify = libc.inotify_init1(os.O_NONBLOCK)
+    if notify < 0:
+        cPrint("Unable to watch lease files, inotify unavailable.", "YELLOW")
+        return None
+
+    for directory in {os.path.dirname(path) for path in filepaths}:
+        if os.path.isdir(directory):
+            libc.inotify_add_watch(
+                notify, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+    return notify
+
+
+##############################################################################80
+# Watch neighbour events (netlink via "ip monitor") and lease file changes,
+# running processScan and processNewDevices on just the affected MACs
+##############################################################################80
+def watchNetwork(ranges, database):
+    cPrint("Watching neighbour table and leases...", "BLUE")
+    lineBuffered()
+    monitor = subprocess.Popen(["ip", "-4", "monitor", "neigh"], stdout=subprocess.PIPE)
+    notify = watchLeases(leaseFiles)
+    sources = [monitor.stdout] + ([notify] if notify is not None else [])
+
+    alerted, pending, lastSave = set(), b"", time.monotonic()
+    while True:
+        ready, _, _ = select.select(sources, [], [], 60)
+        found, newDevices = {}, DeviceStore()
+
+        if monitor.stdout in ready:
+            data = os.read(monitor.stdout.fileno(), 65536)
+            if not data:
+                cPrint("Neighbour monitor exited unexpectedly.", "RED")
+                sys.exit(1)
+            *lines, pending = (pending + data).split(b"\n")
+            for line in lines:
+                match = NEIGHBOUR.match(line)
+                if match:
+                    ip, mac = match.group(1).decode(), match.group(2).decode()
+                    found[mac.upper()] = ip
+
+        if notify in ready:
+            os.read(notify, 65536)  # Drain events, any change re-reads leases
+            for mac, ip in readLeases(leaseFiles).items():
+                if mac not in database and mac not in found:
+                    found[mac] = ip
+
+        hosts = list(filterHosts(found, ranges))
+        if hosts:
+            refreshClock()
+            # Cron runs write the same store, statuses may have been edited;
+            # saving merges them in without losing the sightings batched here
+            if storeStamp(datapath) != database.stamp:
+                database = saveDatabase(datapath, database)
+                lastSave = time.monotonic()
+            database = processScan(hosts, database)
+            recordPresence([host["mac"] for host in hosts], datetime.now())
+
+            for host in hosts:
+                device = database[host["mac"]]
+                if device.Status in ["allowed", "inactive"]:
+                    continue
+                if device.MAC not in alerted:
+                    newDevices[device.MAC] = device
+            if newDevices:
+                processNewDevices(newDevices)
+                alerted.update(newDevices)
+
+        # LastHeard refreshes are batched, new devices are saved immediately
+        if newDevices or time.monotonic() - lastSave > 60:
+            database = saveDatabase(datapath, database)
+            lastSave = time.monotonic()
+
+
+##############################################################################80
+# Write nmap XML of hosts up devices and a database snapshot holding them all
+# as allowed, plus one intruder in a hundred that is not in the scan
+##############################################################################80
+def writeBench(hosts, workpath):
+    first = ipaddress.ip_address("10.0.0.1")
+    lastWeek = (datetime.now() - timedelta(days=7)).strftime("%Y%m%d%H%M")
+
+    with open(f"{workpath}/scanlog.xml", "w") as writer:
+        writer.write('<?xml version="1.0"?>\n<nmaprun scanner="nmap">\n')
+        for index in range(hosts):
+            writer.write(
+                f'<host><status state="up"/>'
+                f'<address addr="{first + index}" addrtype="ipv4"/>'
+                f'<address addr="02:00:{index.to_bytes(4).hex(":").upper()}" '
+                f'addrtype="mac" vendor="Bench Co"/></host>\n'
+            )
+        writer.write("</nmaprun>\n")
+
+    with open(storepath, "w") as writer:
+        writer.write(f'{{"exported":{time.time()},"devices":[')
+        for index in range(hosts + hosts // 100):
+            status = "allowed" if index < hosts else "intruder"
+            mac = f"02:00:{index.to_bytes(4).hex(':').upper()}"
+            ip = formatIP(str(first + index))
+            row = [status, "bench", mac, ip, lastWeek, lastWeek, "Bench Co"]
+            writer.write(("," if index else "") + json.dumps(row))
+        writer.write("]}")
+    open(journalpath, "w").close()
+    shutil.rmtree(presencepath, ignore_errors=True)
+
+
+##############################################################################80
+# Time each stage of consecutive runs, ten minutes apart, on generated scans
+# growing up to hosts devices in a scratch directory; the last run of each size
+# compacts, and the slowest run is held to the target. Memory is the process
+# high water mark after each stage.
+##############################################################################80
+def benchPipeline(hosts):
+    global datapath, storepath, journalpath, presencepath, sweeppath
+    global rangepath, volatilepath
+    workpath = tempfile.mkdtemp(prefix="checkNET.")
+    presencepath = f"{workpath}/presence"
+    sweeppath = f"{workpath}/presence/sweeps"
+    rangepath = f"{workpath}/ranges.csv"
+    volatilepath = f"{workpath}/volatile.json"
+    datapath = f"{workpath}/devices.csv"
+    storepath = f"{workpath}/devices.json"
+    journalpath = f"{workpath}/devices.log"
+    args.debug, args.noscan, args.export = False, False, False
+    ranges = ["10.0.0.0/16"]
+
+    print(f"{'Hosts':>8}{'Run':>5}{'Stage':>11}{'Seconds':>10}{'Peak MiB':>10}")
+    for size in (hosts // 4, hosts // 2, hosts):
+        writeBench(size, workpath)
+        worst = 0
+        for run in range(1, benchRuns + 1):
+            refreshClock(datetime.now() + timedelta(minutes=10 * run))
+            args.export = run == benchRuns
+            timings = []
+
+            def timed(stage, function, *params):
+                start = time.perf_counter()
+                result = function(*params)
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >> 10
+                timings.append((stage, time.perf_counter() - start, peak))
+                return result
+
+            with open(f"{workpath}/scanlog.xml", "rb") as stream:
+                scan = timed("parse", list, streamHosts(stream))
+            data = timed("load", loadDatabase, datapath)
+            targets = timed("schedule", scheduleScan, ranges, data)
+            data = timed("process", processScan, scan, data)
+            heard = [mac for mac in data.heard if data[mac].LastHeard == SCANID]
+            when = datetime.strptime(SCANID, "%Y%m%d%H%M")
+            timed("sweeps", recordPresence, targets, when, sweeppath)
+            timed("presence", recordPresence, heard, when)
+            timed("volatility", refreshVolatility, data, heard, targets, when)
+            timed("alert", processNewDevices, data)
+            timed("save", saveDatabase, datapath, data)
+
+            total, peak = sum(seconds for _, seconds, _ in timings), timings[-1][2]
+            for stage, seconds, peak in timings + [("total", total, peak)]:
+                print(f"{size:>8}{run:>5}{stage:>11}{seconds:>10.3f}{peak:>10}")
+            worst = max(worst, total)
+
+    shutil.rmtree(workpath)
+    refreshClock()
+
+    verdict = "within" if worst <= benchTarget else "over"
+    cPrint(
+        f"{hosts} hosts in {worst:.3f}s at worst over {benchRuns} runs, "
+        f"{verdict} the {benchTarget}s target."
+    )
+    return worst <= benchTarget
+
+
 ##############################################################################80
 # Being Main execution
 ##############################################################################80
 def main():
     cPrint("Beginning main execution...", "BLUE") if args.debug else None
+    if args.updateoui:
+        updateVendorTable(ouipath)
+        sys.exit(0)
+
+    if args.presence:
+        showPresence(args.presence.upper(), args.days)
+        sys.exit(0)
+
+    if args.bench:
+        sys.exit(0 if benchPipeline(args.bench) else 1)
+
     checkSudo()
 
-    scan = getNmapScan(netRange, scanpath)
     data = loadDatabase(datapath)
+    if args.watch:
+        watchNetwork(netRanges, data)
 
+    # Neighbour table and leases every run, sweeps of scheduled targets only
+    scan = getPassiveScan(netRanges, data)
     data = processScan(scan, data)
+
+    # Hosts are merged as nmap reports them, before the sweep has finished
+    targets = [] if args.passive else scheduleScan(netRanges, data)
+    if targets:
+        scan = scanRanges(targets, scanpath)
+        data = processScan(scan, data)
+    heard = [mac for mac in data.heard if data[mac].LastHeard == SCANID]
+    recordPresence(heard, datetime.strptime(SCANID, "%Y%m%d%H%M"))
+    refreshVolatility(data, heard, targets, datetime.strptime(SCANID, "%Y%m%d%H%M"))
+
     processNewDevices(data)
     saveDatabase(datapath, data)
 
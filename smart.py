@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+##############################################################################80
+# S.M.A.R.T. Parser 20261019
+##############################################################################80
+# Description: Queries drives with smartctl's JSON output and parses it into
+# typed reports for ATA, NVMe and SCSI drives, shared by checkHDD/checkDRV.
+# Usage: imports only, or to time the parser against scraping the text table
+#   cd /path/to/folder && ./smart.py --bench 1000
+##############################################################################80
+# Copyright (c) Liam Siira (www.siira.io), distributed as-is and without
+# warranty under the MIT License. See [root]/docs/LICENSE.md for more.
+##############################################################################80
+
+import re
+import json
+import time
+import argparse
+import subprocess
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+smartctl = "/usr/sbin/smartctl"
+# Bits of smartctl's exit status that mean no data was read at all
+smartctlUnusable = 0b011
+
+
+##############################################################################80
+# Typed report: common fields for every drive, plus the attribute table of ATA
+# drives or the health log of NVMe and SCSI drives
+##############################################################################80
+@dataclass
+class AtaAttribute:
+    id: int
+    name: str
+    value: int
+    worst: int
+    thresh: int
+    raw: int
+    prefail: bool
+    whenFailed: str
+
+
+@dataclass
+class NvmeHealth:
+    criticalWarning: int
+    availableSpare: int
+    spareThreshold: int
+    percentageUsed: int
+    mediaErrors: int
+    unsafeShutdowns: int
+    errorLogEntries: int
+
+
+@dataclass
+class ScsiHealth:
+    grownDefects: int
+    readUncorrected: int
+    writeUncorrected: int
+    percentageUsed: int
+
+
+@dataclass
+class SmartReport:
+    device: str
+    protocol: str
+    serial: str
+    model: str
+    capacity: int
+    passed: bool
+    powerOnHours: int
+    powerCycles: int
+    temperature: int
+    exitStatus: int
+    attributes: dict = field(default_factory=dict)
+    nvme: NvmeHealth = None
+    scsi: ScsiHealth = None
+
+
+##############################################################################80
+# Run smartctl on a device, returning its report or None if it could not be
+# read in time; non-zero exit statuses with data, like a failing drive, parse
+##############################################################################80
+def querySMART(device, timeout=None):
+    command = [smartctl, "--json=c", "-a", device]
+    try:
+        result = subprocess.run(
+            command, capture_output=True, text=True, timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return None
+    if result.returncode & smartctlUnusable or not result.stdout:
+        return None
+    return parseSMART(json.loads(result.stdout))
+
+
+def parseSMART(data):
+    device = data.get("device", {})
+    protocol = device.get("protocol", "ATA")
+    report = SmartReport(
+        device=device.get("name", ""),
+        protocol=protocol,
+        serial=data.get("serial_number", ""),
+        model=data.get("model_name", data.get("scsi_model_name", "")),
+        capacity=data.get("user_capacity", {}).get(
+            "bytes", data.get("nvme_total_capacity", 0)
+        ),
+        passed=data.get("smart_status", {}).get("passed", True),
+        powerOnHours=data.get("power_on_time", {}).get("hours", 0),
+        powerCycles=data.get("power_cycle_count", 0),
+        temperature=data.get("temperature", {}).get("current", 0),
+        exitStatus=data.get("smartctl", {}).get("exit_status", 0),
+    )
+
+    for row in data.get("ata_smart_attributes", {}).get("table", []):
+        report.attributes[row["id"]] = AtaAttribute(
+            id=row["id"],
+            name=row["name"],
+            value=row.get("value", 0),
+            worst=row.get("worst", 0),
+            thresh=row.get("thresh", 0),
+            raw=row.get("raw", {}).get("value", 0),
+            prefail=row.get("flags", {}).get("prefailure", False),
+            whenFailed=row.get("when_failed", ""),
+        )
+
+    if "nvme_smart_health_information_log" in data:
+        log = data["nvme_smart_health_information_log"]
+        report.nvme = NvmeHealth(
+            criticalWarning=log.get("critical_warning", 0),
+            availableSpare=log.get("available_spare", 100),
+            spareThreshold=log.get("available_spare_threshold", 0),
+            percentageUsed=log.get("percentage_used", 0),
+            mediaErrors=log.get("media_errors", 0),
+            unsafeShutdowns=log.get("unsafe_shutdowns", 0),
+            errorLogEntries=log.get("num_err_log_entries", 0),
+        )
+
+    if protocol == "SCSI":
+        errors = data.get("scsi_error_counter_log", {})
+        report.scsi = ScsiHealth(
+            grownDefects=data.get("scsi_grown_defect_list", 0),
+            readUncorrected=errors.get("read", {}).get("total_uncorrected_errors", 0),
+            writeUncorrected=errors.get("write", {}).get("total_uncorrected_errors", 0),
+            percentageUsed=data.get("scsi_percentage_used_endurance_indicator", 0),
+        )
+    return report
+
+
+##############################################################################80
+# Query drives concurrently in a bounded pool, each within its own timeout, so
+# runtime follows the slowest drive rather than the sum of all of them. Maps
+# each device, in the order given, to its report or None and seconds taken.
+##############################################################################80
+def queryDrives(devices, workers=8, timeout=30):
+    def timedQuery(device):
+        start = time.perf_counter()
+        report = querySMART(device, timeout)
+        return device, (report, time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(devices)))) as pool:
+        return dict(pool.map(timedQuery, devices))
+
+
+##############################################################################80
+# Benchmark: parse generated smartctl output of an ATA drive both as JSON and
+# by scraping the text table with the regex checkDRV used before
+##############################################################################80
+def sampleOutputs():
+    attributes = [
+        (1, "Raw_Read_Error_Rate", 0, "0x000f"),
+        (5, "Reallocated_Sector_Ct", 0, "0x0033"),
+        (9, "Power_On_Hours", 41234, "0x0032"),
+        (12, "Power_Cycle_Count", 87, "0x0032"),
+        (194, "Temperature_Celsius", 36, "0x0022"),
+        (197, "Current_Pending_Sector", 0, "0x0012"),
+        (198, "Offline_Uncorrectable", 0, "0x0010"),
+        (199, "UDMA_CRC_Error_Count", 0, "0x003e"),
+    ] * 3
+    lines = [
+        "Device Model:     WDC WD40EFRX-68N32N0",
+        "Serial Number:    WD-WCC7K0000000",
+        "User Capacity:    4,000,787,030,016 bytes [4.00 TB]",
+        "ID# ATTRIBUTE_NAME          FLAG     VALUE WORST THRESH TYPE      "
+        "UPDATED  WHEN_FAILED RAW_VALUE",
+    ]
+    table = []
+    for id, name, raw, flags in attributes:
+        flag = int(flags, 16)
+        lines.append(
+            f"{id:>3} {name:<23} {flags}   100   100   000    Old_age   "
+            f"Always       -       {raw}"
+        )
+        table.append(
+            {
+                "id": id,
+                "name": name,
+                "value": 100,
+                "worst": 100,
+                "thresh": 0,
+                "when_failed": "",
+                "flags": {"value": flag, "prefailure": bool(flag & 1)},
+                "raw": {"value": raw, "string": str(raw)},
+            }
+        )
+    data = {
+        "smartctl": {"exit_status": 0},
+        "device": {"name": "/dev/sda", "protocol": "ATA"},
+        "model_name": "WDC WD40EFRX-68N32N0",
+        "serial_number": "WD-WCC7K0000000",
+        "user_capacity": {"blocks": 7814037168, "bytes": 4000787030016},
+        "smart_status": {"passed": True},
+        "ata_smart_attributes": {"table": table},
+        "power_on_time": {"hours": 41234},
+        "power_cycle_count": 87,
+        "temperature": {"current": 36},
+    }
+    return "\n".join(lines), json.dumps(data, separators=(",", ":"))
+
+
+def scrapeText(output):
+    health = {}
+    for line in output.splitlines():
+        match = re.match(r"^\s*(\d+)\s+(\w+[\w\s]*\w+)\s+.*\s+(\d+)\s+.*$", line)
+        if match:
+            health[match.group(1)] = int(match.group(3))
+    return health
+
+
+def benchParsers(rounds):
+    text, document = sampleOutputs()
+    timings = []
+    for name, parse in (
+        ("regex", lambda: scrapeText(text)),
+        ("json", lambda: parseSMART(json.loads(document))),
+    ):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            parse()
+        timings.append((name, (time.perf_counter() - start) / rounds * 10**6))
+
+    for name, micros in timings:
+        print(f"{name:<6} {micros:8.1f} us per drive")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parses smartctl JSON output.")
+    parser.add_argument(
+        "--bench",
+        type=int,
+        nargs="?",
+        const=1000,
+        help="Times the JSON parser against the text regex over N drives.",
+    )
+    args = parser.parse_args()
+    if args.bench:
+        benchParsers(args.bench)
@@ -4,11 +4,15 @@
 # Taillog 20231224 - Tagline
 ##############################################################################80
 # Description
-#   A log file curtailer, used to manage log sizes for custom commands. High
-#   performance not guaranteed with marge maximum ceilings.
+#   A log file curtailer, used to manage log sizes for custom commands. Byte
+#   mode curtails in place; line mode is not optimised for large ceilings.
 # Usage:
 #   Line Mode: echo -ne "$(date)\n" | ./tailog.py -lm 100 -f cron.log
 #   Byte Mode: echo -ne "$(date)\n" | ./tailog.py -bm 500 -f cron.log
+#   Archiving: echo -ne "$(date)\n" | ./tailog.py -lm 100 -a gzip -k 5
+#   JSON Mode: ./checkNET.py -c 2>&1 | ./tailog.py -jlm 5000 -f cron.jsonl
+#   Querying:  ./tailog.py -f cron.jsonl query --script checkNET --since 2d
+#   Benchmark: ./tailog.py -f /var/tmp/bench.log bench --size 4096
 ##############################################################################80
 # Copyright (c) Liam Siira (www.siira.io), distributed as-is and without
 # warranty under the MIT License. See [root]/docs/LICENSE.md for more.
@@ -16,8 +20,19 @@
 ##############################################################################80
 
 from sys import stdin
+from itertools import islice
+from datetime import datetime, timedelta
 import os
+import re
+import gzip
+import json
+import mmap
+import time
+import ctypes
+import ctypes.util
 import argparse
+import tracemalloc
+import subprocess
 
 parser = argparse.ArgumentParser(description="Create a tailog.")
 
@@ -54,11 +69,327 @@ group.add_argument(
     const="byte",
     help="limit the log by byte count",
 )
+parser.add_argument(
+    "-a",
+    dest="archive",
+    metavar="METHOD",
+    choices=["gzip", "zstd"],
+    default=None,
+    help="compress curtailed data into rotating archives (gzip or zstd)",
+)
+parser.add_argument(
+    "-k",
+    dest="keep",
+    metavar="KEEP",
+    type=int,
+    default=5,
+    help="the number of archives to retain (default 5)",
+)
+parser.add_argument(
+    "-r",
+    dest="rotate",
+    metavar="ROTATE",
+    type=int,
+    default=1048576,
+    help="the compressed byte size at which archives rotate (default 1MiB)",
+)
+parser.add_argument(
+    "-j",
+    dest="json",
+    action="store_true",
+    help="store entries as JSON lines, indexed by script and SCANID",
+)
+
+subparsers = parser.add_subparsers(dest="command")
+query = subparsers.add_parser("query", help="query a JSON lines tailog")
+query.add_argument("--script", help="only entries logged by this script")
+query.add_argument("--scanid", help="only entries logged with this SCANID")
+query.add_argument(
+    "--since",
+    metavar="AGE",
+    help="only entries newer than AGE, such as 30m, 12h, 2d or 1w",
+)
+query.add_argument(
+    "--raw", action="store_true", help="print matching entries as JSON lines"
+)
+bench = subparsers.add_parser("bench", help="benchmark byte mode curtailing")
+bench.add_argument(
+    "--size",
+    metavar="MIB",
+    type=int,
+    default=2048,
+    help="the size of the generated log in MiB (default 2048)",
+)
 
 args = parser.parse_args()
 
 (maximum, logpath, mode) = args.ceil, args.path, args.mode
 
+# Archive file extensions per compression method
+ARCHIVES = {"gzip": ".gz", "zstd": ".zst"}
+CHUNKSIZE = 1048576
+FALLOC_FL_COLLAPSE_RANGE = 0x08
+
+
+##############################################################################80
+# Rotate archives once the current one is full, dropping the oldest beyond keep
+##############################################################################80
+def rotateArchives(logpath, ext, keep, limit):
+    current = f"{logpath}.1{ext}"
+    if not os.path.exists(current) or os.path.getsize(current) < limit:
+        return current
+
+    for index in range(max(keep, 1), 0, -1):
+        older = f"{logpath}.{index}{ext}"
+        if not os.path.exists(older):
+            continue
+        if index >= keep:
+            os.remove(older)
+        else:
+            os.rename(older, f"{logpath}.{index + 1}{ext}")
+    return current
+
+
+##############################################################################80
+# Stream curtailed chunks into the current archive; gzip members and zstd
+# frames are both concatenable, so each run simply appends a new one
+##############################################################################80
+def archiveChunks(chunks, logpath, method):
+    ext = ARCHIVES[method]
+    archpath = rotateArchives(logpath, ext, args.keep, args.rotate)
+
+    if method == "gzip":
+        with gzip.open(archpath, "ab") as archive:
+            for chunk in chunks:
+                archive.write(chunk)
+        return
+
+    with open(archpath, "ab") as archive:
+        proc = subprocess.Popen(
+            ["zstd", "-q", "-c"], stdin=subprocess.PIPE, stdout=archive
+        )
+        for chunk in chunks:
+            proc.stdin.write(chunk)
+        proc.stdin.close()
+        if proc.wait() != 0:
+            exit(proc.returncode)
+
+
+##############################################################################80
+# Convert cron formatted output from cPrint into JSON line entries, lines
+# without the "SCRIPTNAME: SCANID" prefix inherit the previous entry's prefix
+##############################################################################80
+PREFIX = re.compile(r"^(\w+): (\d{12}) (.*)$")
+
+
+def parseEntries(lines):
+    script, scanid = "unknown", datetime.now().strftime("%Y%m%d%H%M")
+    for line in lines:
+        line = line.rstrip("\n")
+        match = PREFIX.match(line)
+        if match:
+            script, scanid, line = match.groups()
+        yield {"script": script, "scanid": scanid, "message": line}
+
+
+##############################################################################80
+# Append entries to the log, recording one index segment per run of entries
+# sharing a script, as {script, first, last, offset, length} JSON lines
+##############################################################################80
+def appendEntries(logpath, entries):
+    segments = []
+    offset = os.path.getsize(logpath)
+    with open(logpath, "ab") as logfile:
+        for entry in entries:
+            data = (json.dumps(entry) + "\n").encode("utf-8")
+            logfile.write(data)
+
+            segment = segments[-1] if segments else None
+            if not segment or segment["script"] != entry["script"]:
+                segment = {"script": entry["script"], "first": entry["scanid"]}
+                segment.update(last=entry["scanid"], offset=offset, length=0)
+                segments.append(segment)
+            segment["last"] = max(segment["last"], entry["scanid"])
+            segment["length"] += len(data)
+            offset += len(data)
+
+    with open(f"{logpath}.idx", "a") as index:
+        for segment in segments:
+            index.write(json.dumps(segment) + "\n")
+
+
+##############################################################################80
+# Shift index segments after cut bytes were curtailed from the log head
+##############################################################################80
+def trimIndex(logpath, cut):
+    idxpath = f"{logpath}.idx"
+    if not os.path.exists(idxpath):
+        return
+
+    segments = []
+    with open(idxpath) as index:
+        for line in index:
+            segment = json.loads(line)
+            end = segment["offset"] + segment["length"]
+            if end <= cut:
+                continue
+            segment["offset"] = max(segment["offset"] - cut, 0)
+            segment["length"] = end - cut - segment["offset"]
+            segments.append(segment)
+
+    with open(f"{idxpath}.temp", "w") as index:
+        for segment in segments:
+            index.write(json.dumps(segment) + "\n")
+    os.replace(f"{idxpath}.temp", idxpath)
+
+
+##############################################################################80
+# Answer a query from the index, only reading the matching log segments
+##############################################################################80
+def queryLog(logpath, script=None, scanid=None, since=None):
+    idxpath = f"{logpath}.idx"
+    if not os.path.exists(idxpath):
+        return
+
+    oldest = scanid or ""
+    if since:
+        units = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+        match = re.fullmatch(r"(\d+)([mhdw])", since)
+        if not match:
+            parser.error(f"invalid --since value: {since}")
+        delta = timedelta(**{units[match.group(2)]: int(match.group(1))})
+        oldest = max(oldest, (datetime.now() - delta).strftime("%Y%m%d%H%M"))
+
+    with open(idxpath) as index, open(logpath, "rb") as logfile:
+        for line in index:
+            segment = json.loads(line)
+            if script and segment["script"] != script:
+                continue
+            if segment["last"] < oldest:
+                continue
+            if scanid and not segment["first"] <= scanid <= segment["last"]:
+                continue
+
+            logfile.seek(segment["offset"])
+            for data in logfile.read(segment["length"]).splitlines():
+                try:
+                    entry = json.loads(data)
+                except ValueError:
+                    continue  # Partial line left behind by byte mode
+                if entry["scanid"] < oldest:
+                    continue
+                if scanid and entry["scanid"] != scanid:
+                    continue
+                yield entry
+
+
+##############################################################################80
+# Yield the first count bytes of a file in bounded chunks
+##############################################################################80
+def readChunks(file, count):
+    while count > 0:
+        chunk = file.read(min(CHUNKSIZE, count))
+        if not chunk:
+            break
+        count -= len(chunk)
+        yield chunk
+
+
+##############################################################################80
+# Move the cut forward to the next line boundary so no partial line is kept
+##############################################################################80
+def findCut(logpath, offset):
+    with open(logpath, "rb") as logfile:
+        with mmap.mmap(logfile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            newline = mm.find(b"\n", offset)
+    return offset if newline < 0 else newline + 1
+
+
+##############################################################################80
+# Remove the first length bytes of a file without rewriting the rest, only
+# supported on some filesystems (ext4, xfs) and for block aligned lengths
+##############################################################################80
+def collapseRange(fd, length):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fallocate = libc.fallocate64
+    except (OSError, AttributeError):
+        return False
+
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    return fallocate(fd, FALLOC_FL_COLLAPSE_RANGE, 0, length) == 0
+
+
+##############################################################################80
+# Curtail the first cut bytes in place, returns the number of bytes removed.
+# Large remainders have whole blocks collapsed where possible, blanking the
+# rest of the line crossing the last block boundary with spaces, so the log
+# starts with one blank line; small remainders, or filesystems without
+# collapse support, are shifted down in chunks through mmap instead.
+##############################################################################80
+def trimInPlace(logpath, cut):
+    size = os.path.getsize(logpath)
+    with open(logpath, "r+b") as logfile:
+        fd = logfile.fileno()
+        aligned = cut - cut % os.fstat(fd).st_blksize
+        if aligned and size - cut > CHUNKSIZE and collapseRange(fd, aligned):
+            if cut - aligned > 1:
+                logfile.write(b" " * (cut - aligned - 1))
+            return aligned
+
+        with mmap.mmap(fd, 0) as mm:
+            for pos in range(cut, size, CHUNKSIZE):
+                mm.move(pos - cut, pos, min(CHUNKSIZE, size - pos))
+            mm.flush()
+        logfile.truncate(size - cut)
+    return cut
+
+
+##############################################################################80
+# Previous byte mode curtailing through a temporary copy, kept for benchmarks
+##############################################################################80
+def trimByCopy(logpath, offset):
+    tempath = f"{logpath}.temp"
+    with open(tempath, "wb") as temfile, open(logpath, "rb") as logfile:
+        logfile.seek(offset)
+        temfile.write(logfile.read())
+    os.remove(logpath)
+    os.rename(tempath, logpath)
+    return offset
+
+
+##############################################################################80
+# Time and measure peak memory of byte mode curtailing on a generated log
+##############################################################################80
+def benchTrim(logpath, size):
+    line = b"checkNET: 202401010000 Device detected: 00:00:00:00:00:00 on 192.168.1.1\n"
+    chunk = line * (CHUNKSIZE // len(line))
+    methods = {
+        "copy": trimByCopy,
+        "inplace": lambda path, offset: trimInPlace(path, findCut(path, offset)),
+    }
+
+    for name, method in methods.items():
+        with open(logpath, "wb") as logfile:
+            for _ in range(size):
+                logfile.write(chunk)
+        os.sync()
+
+        logsize = os.path.getsize(logpath)
+        tracemalloc.start()
+        start = time.perf_counter()
+        removed = method(logpath, logsize // 2)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print(
+            f"{name:>8}: {logsize >> 20} MiB, removed {removed >> 20} MiB "
+            f"in {elapsed:.3f}s, peak memory {peak >> 10} KiB"
+        )
+        os.remove(logpath)
+
+
 # Get absolute path of the log file
 if not os.path.isabs(logpath):
     dname = os.getcwd()
@@ -68,12 +399,28 @@ logpath = os.path.abspath(logpath)
 if not os.path.exists(logpath):
     open(logpath, "a").close()
 
+# Benchmark subcommand works on its own generated file next to the log
+if args.command == "bench":
+    benchTrim(f"{logpath}.bench", args.size)
+    exit(0)
+
+# Query subcommand only reads the log, it never appends or curtails
+if args.command == "query":
+    for entry in queryLog(logpath, args.script, args.scanid, args.since):
+        if args.raw:
+            print(json.dumps(entry))
+        else:
+            print(f"{entry['script']}: {entry['scanid']} {entry['message']}")
+    exit(0)
 
 # Append stdin to the current log file and close the write process
-logfile = open(logpath, "a")
-for line in stdin:
-    logfile.write(line)
-logfile.close()
+if args.json:
+    appendEntries(logpath, parseEntries(stdin))
+else:
+    logfile = open(logpath, "a")
+    for line in stdin:
+        logfile.write(line)
+    logfile.close()
 
 logsize = 0
 
@@ -94,30 +441,38 @@ elif mode == "byte":
 if logsize <= maximum:
     exit(0)
 
-# Log file too large, create a temporary file to hold the curtailed log data
-tempath = f"{logpath}.temp"
-if not os.path.exists(tempath):
-    open(tempath, "a").close()
-
 # Read the log file, and start writing to the temp log once the offset is reached
 # offset representing the old data that needs to be curtailed
 offset = logsize - maximum
 if mode == "line":
-    temfile = open(tempath, "a")
-    lines = iter(open(logpath))
-    for _ in range(offset):
-        next(lines)
+    # Log file too large, create a temporary file to hold the curtailed log data
+    tempath = f"{logpath}.temp"
+    temfile = open(tempath, "ab")
+    lines = iter(open(logpath, "rb"))
+    if args.archive:
+        archiveChunks(islice(lines, offset), logpath, args.archive)
+    else:
+        for _ in range(offset):
+            next(lines)
     temfile.writelines(lines)
 
+    # Close the tempfile and replace the log file with the temporary file
+    temfile.close()
+    trimIndex(logpath, os.path.getsize(logpath) - os.path.getsize(tempath))
+    os.remove(logpath)
+    os.rename(tempath, logpath)
+
 elif mode == "byte":
-    temfile = open(tempath, "wb")
-    logfile = open(logpath, "rb")
-    logfile.seek(offset)
-    temfile.write(logfile.read())
-
-# Close the tempfile and replace the log file with the temporary file
-temfile.close()
-os.remove(logpath)
-os.rename(tempath, logpath)
+    # Curtail in place, aligned to the next line so no partial line is kept.
+    # Large remainders are cut from the next block boundary on, so whole blocks
+    # can be collapsed while the log stays within the limit
+    blocksize = os.stat(logpath).st_blksize
+    aligned = -(-offset // blocksize) * blocksize
+    cut = findCut(logpath, aligned if logsize - aligned > CHUNKSIZE else offset)
+    if args.archive:
+        with open(logpath, "rb") as logfile:
+            archiveChunks(readChunks(logfile, cut), logpath, args.archive)
+    trimIndex(logpath, trimInPlace(logpath, cut))
+
 os.chmod(logpath, 0o770)
 exit(0)
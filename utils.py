@@ -139,6 +139,33 @@ def formatIP(ip):
     return ".".join(octets)
 
 
+##############################################################################80
+# Append text to a file in one synced write. A file left without a trailing
+# newline by a crash mid-append gets one first, so readers can skip the torn
+# line; an empty file starts with header.
+##############################################################################80
+def appendSynced(filepath, text, header="", newline="\n"):
+    fd = os.open(filepath, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o666)
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0:
+            text = header + text
+        elif os.pread(fd, 1, size - 1) != b"\n":
+            text = newline + text
+        os.write(fd, text.encode("utf-8"))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+##############################################################################80
+# Flush output on every line for long running services, whose output would
+# otherwise reach the systemd journal in blocks
+##############################################################################80
+def lineBuffered():
+    sys.stdout.reconfigure(line_buffering=True)
+
+
 ##############################################################################80
 # Load credentials from json file
 ##############################################################################80